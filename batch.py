@@ -0,0 +1,114 @@
+import asyncio
+import argparse
+import csv
+import json
+import os
+import re
+import traceback
+from rich.markup import escape
+from rich.progress import Progress
+from manifest import RunManifest
+import main
+from main import console
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate one card game per concept in a JSONL or CSV job file, without prompting")
+    parser.add_argument("jobs",
+                        help="JSONL file with one {\"concept\": ..., \"name\": ...} object per line, "
+                             "or a CSV file with 'concept' and optional 'name' columns")
+    parser.add_argument("--out-dir", default="decks",
+                        help="Directory that receives one sub-directory per game (default: decks)")
+    parser.add_argument("--max-decks", type=int, default=8,
+                        help="Games generated at the same time (default: 8)")
+    main.add_generation_arguments(parser)
+    # A batch shares one request budget, so default to a much larger one than main.py
+    parser.set_defaults(concurrency=32, batch_size=10)
+    args = parser.parse_args()
+    main.check_generation_arguments(parser, args)
+    if args.max_decks < 1:
+        parser.error("--max-decks must be at least 1")
+    return args
+
+def load_jobs(path):
+    """Read the jobs as a list of {'concept': ..., 'name': ...} dicts"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    names = set()
+    for number, row in enumerate(rows, start=1):
+        concept = (row.get('concept') or '').strip()
+        if not concept:
+            raise ValueError(f"Job {number} in '{path}' has no concept")
+        name = _safe_name(row.get('name') or f"game{number}")
+        if name in names:
+            raise ValueError(f"Job {number} in '{path}' reuses the name '{name}'")
+        names.add(name)
+        jobs.append({'concept': concept, 'name': name})
+    return jobs
+
+def _safe_name(name):
+    return re.sub(r'[^\w\- ]+', '_', str(name)).strip() or 'game'
+
+async def generate_batch(generator, jobs, args, progress):
+    """Generate every job into its own directory under args.out_dir.
+
+    All games share `generator`, so its rate limits apply to the whole batch, and one
+    semaphore caps the API requests in flight across all of them. A game directory that
+    already has a manifest is resumed rather than started again.
+    Returns {name: exception} for the games that failed.
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+    deck_slots = asyncio.Semaphore(args.max_decks)
+    failures = {}
+
+    async def run_job(job):
+        output_dir = os.path.join(args.out_dir, job['name'])
+        label = escape(f"[{job['name']}] ")
+        async with deck_slots:
+            try:
+                if os.path.exists(os.path.join(output_dir, 'manifest.json')):
+                    manifest = RunManifest.load(output_dir)
+                else:
+                    manifest = RunManifest.create(output_dir, job['concept'])
+                await main.generate_game(generator, manifest, args, progress, output_dir=output_dir,
+                                         semaphore=semaphore, label=label)
+                console.print(f"[green]✓[/green] {label}Saved to '{output_dir}'")
+            except Exception as e:
+                failures[job['name']] = e
+                console.print(f"[red]✗[/red] {label}Failed: {str(e)}")
+                console.print(traceback.format_exc())
+
+    await asyncio.gather(*(run_job(job) for job in jobs))
+    return failures
+
+async def run(args):
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        console.print("[red]Please set your OPENAI_API_KEY environment variable[/red]")
+        return 1
+
+    jobs = load_jobs(args.jobs)
+    console.print(f"[bold green]Generating {len(jobs)} games into '{args.out_dir}'[/bold green]")
+    generator = main.build_generator(args, api_key)
+    try:
+        with Progress() as progress:
+            failures = await generate_batch(generator, jobs, args, progress)
+    finally:
+        await generator.aclose()
+        main.write_metrics(generator, args)
+
+    console.print(f"\n[bold]{len(jobs) - len(failures)} of {len(jobs)} games generated[/bold]")
+    if failures:
+        console.print(f"[red]Failed: {', '.join(sorted(failures))}. Run the batch again to resume them.[/red]")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    args = parse_args()
+    main.configure_logging(args)
+    raise SystemExit(asyncio.run(run(args)))
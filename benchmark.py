@@ -0,0 +1,279 @@
+"""Offline benchmark for the card generation pipeline.
+
+Runs the full rules -> cards -> PDF flow against the local MockOpenAIServer for each
+deck size and reports wall time, request throughput, per-stage latency percentiles
+time to the first finished card and peak RSS as JSON, so results can be compared
+between commits:
+
+    python benchmark.py --decks 10 100 1000 --concurrency 16 --batch-size 10 --output bench.json
+
+Each deck runs in its own subprocess so peak RSS is measured per deck size. Add
+--stream-rules to measure the pipelined flow that starts cards while the rules stream.
+
+With --render, only cards.pdf rendering is timed, comparing the serial renderer with
+a pool of --render-workers processes on decks of unique backgrounds:
+
+    python benchmark.py --render --decks 100 1000 --render-workers 4
+
+With --startup, only start-up cost is measured: the `python -X importtime` import time
+of each entry-point module, its slowest direct imports, and `main.py --help` wall time:
+
+    python benchmark.py --startup
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_openai import MockOpenAIServer
+
+CONCEPT = "A fast-paced fantasy duel where wizards trade spells and summon creatures"
+STARTUP_MODULES = ('main', 'batch', 'card_generator')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+async def run_deck(base_url, concurrency, batch_size, stream_rules, output_dir):
+    """Generate one deck against `base_url` and return its timings"""
+    # Imported here so the parent process doesn't pay for them
+    from card_generator import CardGenerator
+    from manifest import RunManifest
+    from rich.progress import Progress
+    import main
+
+    main.console.quiet = True
+    parser = argparse.ArgumentParser()
+    main.add_generation_arguments(parser)
+    args = parser.parse_args(['--concurrency', str(concurrency), '--batch-size', str(batch_size), '--no-cache']
+                             + (['--stream-rules'] if stream_rules else []))
+    main.check_generation_arguments(parser, args)
+    first_card = []
+
+    def on_event(event, name, **data):
+        if event == 'count' and name == 'cards_completed' and not first_card:
+            first_card.append(time.perf_counter() - start)
+
+    async with CardGenerator('mock-key', base_url=base_url) as generator:
+        generator.metrics.add_hook(on_event)
+        manifest = RunManifest.create(os.path.join(output_dir, 'run'), CONCEPT)
+        start = time.perf_counter()
+        with Progress(disable=True) as progress:
+            _, cards_pdf = await main.generate_game(generator, manifest, args, progress, output_dir=output_dir)
+        wall_time = time.perf_counter() - start
+
+    return dict(
+        cards=len(manifest.completed_cards()),
+        wall_time_s=round(wall_time, 3),
+        first_card_s=round(first_card[0], 3) if first_card else None,
+        **generator.metrics.report(),
+        cards_pdf_mb=round(os.path.getsize(cards_pdf) / (1024 * 1024), 2),
+        peak_rss_mb=peak_rss_mb()
+    )
+
+
+def worker(args):
+    """Subprocess entry point: run one deck and write its result to args.result"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        result = asyncio.run(run_deck(args.base_url, args.concurrency, args.batch_size, args.stream_rules,
+                                      output_dir))
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+
+def render_deck(deck_size, workers, output_dir):
+    """Time create_card_pdf on `deck_size` cards, serially and with `workers` processes"""
+    from card_generator import CardGenerator
+
+    server = MockOpenAIServer(image_variants=8)
+    cards = []
+    for index in range(deck_size):
+        # Bytes after the PNG's end are ignored by decoders, but make every background
+        # unique so the renderer can't skip resampling repeats
+        path = os.path.join(output_dir, f"{index:04d}.png")
+        with open(path, 'wb') as f:
+            f.write(server.images[index % len(server.images)] + index.to_bytes(4, 'big'))
+        cards.append({"title": f"Card {index}", "type": "Action", "background": path,
+                      "description": "Draw two cards, then discard one card of your choice. " * 2})
+
+    generator = CardGenerator('mock-key')
+    result = {"deck_size": deck_size, "workers": workers}
+    for mode, mode_workers in (('serial', 1), ('parallel', workers)):
+        output_file = os.path.join(output_dir, f"cards-{mode}.pdf")
+        start = time.perf_counter()
+        generator.create_card_pdf(cards, output_file, workers=mode_workers)
+        result[f"{mode}_s"] = round(time.perf_counter() - start, 3)
+        result[f"{mode}_pdf_mb"] = round(os.path.getsize(output_file) / (1024 * 1024), 2)
+    result["speedup"] = round(result["serial_s"] / result["parallel_s"], 2)
+    return result
+
+
+def benchmark_render(args):
+    results = []
+    for deck_size in args.decks:
+        print(f"Rendering {deck_size} cards...", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as output_dir:
+            results.append(render_deck(deck_size, args.render_workers, output_dir))
+    return {
+        "config": {
+            "render_workers": args.render_workers,
+            "cpus": os.cpu_count(),
+            "python": platform.python_version()
+        },
+        "results": results
+    }
+
+
+def import_times(module):
+    """Import `module` in a fresh interpreter and return its -X importtime entries.
+
+    Each entry is (name, depth, self_ms, cumulative_ms); depth 0 is `module` itself.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True, cwd=REPO_DIR)
+    entries = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package", nested names indented
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us) / 1000, int(cumulative_us) / 1000))
+    top = next(depth for name, depth, _, _ in reversed(entries) if name == module)
+    return [(name, depth - top, self_ms, cumulative_ms) for name, depth, self_ms, cumulative_ms in entries]
+
+
+def benchmark_startup(args):
+    results = []
+    for module in STARTUP_MODULES:
+        runs = [import_times(module) for _ in range(args.startup_runs)]
+        totals = [next(cumulative for name, depth, _, cumulative in run if depth == 0 and name == module)
+                  for run in runs]
+        slowest = sorted((entry for entry in runs[-1] if entry[1] == 1), key=lambda entry: -entry[3])[:5]
+        results.append({
+            "module": module,
+            "import_ms": round(statistics.median(totals), 1),
+            "slowest_imports_ms": {name: round(cumulative, 1) for name, _, _, cumulative in slowest}
+        })
+
+    help_times = []
+    for _ in range(args.startup_runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '--help'], capture_output=True, check=True, cwd=REPO_DIR)
+        help_times.append(time.perf_counter() - start)
+    return {
+        "config": {"runs": args.startup_runs, "python": platform.python_version()},
+        "imports": results,
+        "main_help_wall_ms": round(statistics.median(help_times) * 1000, 1)
+    }
+
+
+async def benchmark_deck(args, deck_size):
+    server = MockOpenAIServer(
+        latency=args.latency, image_latency=args.image_latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, deck_size=deck_size, seed=deck_size
+    )
+    base_url = await server.start()
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as result_file:
+            result_path = result_file.name
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker',
+            '--base-url', base_url, '--result', result_path,
+            '--concurrency', str(args.concurrency), '--batch-size', str(args.batch_size),
+            *(['--stream-rules'] if args.stream_rules else [])
+        )
+        if await process.wait() != 0:
+            raise RuntimeError(f"Benchmark worker for {deck_size} cards failed")
+        with open(result_path) as f:
+            result = json.load(f)
+        os.remove(result_path)
+    finally:
+        await server.stop()
+
+    requests = server.stats['chat'] + server.stats['images'] + server.stats['downloads']
+    return dict(
+        deck_size=deck_size,
+        requests=requests,
+        requests_per_s=round(requests / result['wall_time_s'], 2),
+        server=server.stats,
+        **result
+    )
+
+
+async def benchmark(args):
+    results = []
+    for deck_size in args.decks:
+        print(f"Benchmarking {deck_size} cards...", file=sys.stderr)
+        results.append(await benchmark_deck(args, deck_size))
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "stream_rules": args.stream_rules,
+            "latency_s": args.latency,
+            "image_latency_s": args.image_latency,
+            "jitter_s": args.jitter,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "python": platform.python_version()
+        },
+        "results": results
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark card generation against a local mock OpenAI API")
+    parser.add_argument("--decks", type=int, nargs='+', default=[10, 100, 1000],
+                        help="Deck sizes to benchmark (default: 10 100 1000)")
+    parser.add_argument("--concurrency", type=int, default=16, help="API requests in flight (default: 16)")
+    parser.add_argument("--batch-size", type=int, default=10, help="Cards per chat request (default: 10)")
+    parser.add_argument("--stream-rules", action="store_true",
+                        help="Stream the rules and start cards as soon as their type is known")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds per chat request")
+    parser.add_argument("--image-latency", type=float, default=0.2, help="Mock seconds per image request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random +/- seconds added to each latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with a 429")
+    parser.add_argument("--render", action="store_true",
+                        help="Only benchmark cards.pdf rendering, serial against --render-workers processes")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for the parallel renderer with --render (default: CPU count)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Only benchmark start-up: import times and `main.py --help` wall time")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="Fresh interpreters per start-up measurement; the median is reported (default: 5)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    # Internal: used by the per-deck subprocess
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.worker:
+        worker(args)
+    else:
+        if args.startup:
+            report = benchmark_startup(args)
+        elif args.render:
+            report = benchmark_render(args)
+        else:
+            report = asyncio.run(benchmark(args))
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
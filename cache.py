@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import tempfile
+from fileutil import replace_file
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache for chat responses and generated images.
+
+    Entries are stored as `<sha256>.json` (function call arguments) or `<sha256>.<ext>`
+    (image bytes) in a flat directory. Reading an entry refreshes its modification time,
+    and once the directory grows past `max_bytes` the least recently used entries are
+    deleted. With `refresh=True` every lookup misses, but new responses are still stored.
+    """
+
+    def __init__(self, directory='.card_cache', max_bytes=1024 * 1024 * 1024, refresh=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def key(**request):
+        """Hash a request description (model, messages, schema, image params...) into a cache key"""
+        encoded = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def get_json(self, key):
+        data = self._read(f"{key}.json")
+        return None if data is None else json.loads(data)
+
+    def set_json(self, key, value):
+        self._write(f"{key}.json", json.dumps(value).encode('utf-8'))
+
+    def get_bytes(self, key, ext='png'):
+        return self._read(f"{key}.{ext}")
+
+    def set_bytes(self, key, data, ext='png'):
+        self._write(f"{key}.{ext}", data)
+
+    def _read(self, name):
+        if self.refresh:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # Mark as recently used
+        return data
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        try:
+            self._size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+
+        # Write to a temp file first so a crash never leaves a truncated entry behind
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        replace_file(temp_path, path)
+
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.endswith('.tmp')]
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in `max_bytes`"""
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
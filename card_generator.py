@@ -1,167 +1,321 @@
-from openai import AsyncOpenAI
-import json
-from PIL import Image, ImageDraw, ImageFont
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+import asyncio
+import collections
+import colorsys
+import concurrent.futures
+import functools
+import hashlib
+import heapq
 import io
-import aiohttp
-import tempfile
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph
-from markdown import markdown
+import json
+import logging
+import os
 import re
-from bs4 import BeautifulSoup
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.fonts import addMapping
-from reportlab.pdfbase.pdfmetrics import registerFont, registerFontFamily
-import asyncio
+import tempfile
+from reportlab.lib.pagesizes import A4
+from retry import RateLimiter, CircuitOpenError
+from metrics import RunMetrics
+from stream_parser import ArrayItemParser
+from image_reuse import ImageReuse
 
-class CardGenerator:
-    def __init__(self, api_key):
-        self.client = AsyncOpenAI(api_key=api_key)
-        self.cards_per_page = 9  # 3x3 grid
-        self.card_width = A4[0] / 3
-        self.card_height = A4[1] / 3
-        
-        # Register fonts
-        pdfmetrics.registerFont(pdfmetrics.Font('Helvetica', 'Helvetica', 'WinAnsiEncoding'))
-        pdfmetrics.registerFont(pdfmetrics.Font('Helvetica-Bold', 'Helvetica-Bold', 'WinAnsiEncoding'))
-        pdfmetrics.registerFontFamily(
-            'Helvetica',
-            normal='Helvetica',
-            bold='Helvetica-Bold',
-            italic='Helvetica',  # Fallback to normal since we don't have italic
-            boldItalic='Helvetica-Bold'  # Fallback to bold
-        )
-        
-        # Define functions for GPT-4o
-        self.rules_functions = [
-            {
-                "name": "define_game_rules",
-                "description": "Define the rules and card specifications for a card game",
-                "parameters": {
+# openai, aiohttp, PIL and most of reportlab take most of a second to import, so they
+# are imported by the methods that need them: CLI calls that never reach the API or
+# the PDF code, and short-lived render workers, don't pay for them
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())  # Silent unless the application configures logging
+
+# Fallback gradient PNGs already rendered by this process, keyed by colour pair
+_fallback_backgrounds = {}
+
+def read_image_bytes(source):
+    """Return the bytes of a background given as a file path or an in-memory buffer"""
+    if isinstance(source, io.BytesIO):
+        return source.getvalue()
+    with open(source, 'rb') as f:
+        return f.read()
+
+def resample_background(image_data, size, dpi, jpeg_quality):
+    """Center-crop an image to the aspect ratio of `size` (in points) and return it as JPEG bytes at `dpi`"""
+    from PIL import Image
+    img = Image.open(io.BytesIO(image_data)).convert('RGB')
+    
+    # Crop the largest centered region with the card's aspect ratio
+    aspect = size[0] / size[1]
+    crop_width = min(img.width, round(img.height * aspect))
+    crop_height = min(img.height, round(img.width / aspect))
+    left = (img.width - crop_width) // 2
+    top = (img.height - crop_height) // 2
+    img = img.crop((left, top, left + crop_width, top + crop_height))
+    
+    # Resample to the print resolution (1 pt = 1/72 inch), never upscaling
+    target = (round(size[0] / 72 * dpi), round(size[1] / 72 * dpi))
+    if target[0] < img.width:
+        img = img.resize(target, Image.LANCZOS)
+    
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+    return output.getvalue()
+
+# Define functions for GPT-4o
+RULES_FUNCTIONS = [
+    {
+        "name": "define_game_rules",
+        "description": "Define the rules and card specifications for a card game",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "game_title": {
+                    "type": "string",
+                    "description": "The title of the card game"
+                },
+                "objective": {
+                    "type": "string",
+                    "description": "The main objective of the game"
+                },
+                "cards": {
                     "type": "object",
+                    "description": "Specification of all card types and their quantities",
                     "properties": {
-                        "game_title": {
-                            "type": "string",
-                            "description": "The title of the card game"
-                        },
-                        "objective": {
-                            "type": "string",
-                            "description": "The main objective of the game"
-                        },
-                        "cards": {
-                            "type": "object",
-                            "description": "Specification of all card types and their quantities",
-                            "properties": {
-                                "card_types": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "object",
-                                        "properties": {
-                                            "type": {
-                                                "type": "string",
-                                                "description": "The type of card (e.g., Action, Item)"
-                                            },
-                                            "quantity": {
-                                                "type": "integer",
-                                                "description": "Number of cards of this type"
-                                            },
-                                            "description": {
-                                                "type": "string",
-                                                "description": "Description of what this type of card does"
-                                            }
-                                        }
+                        "card_types": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "type": {
+                                        "type": "string",
+                                        "description": "The type of card (e.g., Action, Item)"
+                                    },
+                                    "quantity": {
+                                        "type": "integer",
+                                        "description": "Number of cards of this type"
+                                    },
+                                    "description": {
+                                        "type": "string",
+                                        "description": "Description of what this type of card does"
                                     }
-                                },
-                                "total_cards": {
-                                    "type": "integer",
-                                    "description": "Total number of cards in the game"
                                 }
                             }
                         },
-                        "setup": {
-                            "type": "string",
-                            "description": "How to set up the game"
-                        },
-                        "gameplay": {
-                            "type": "string",
-                            "description": "How to play the game"
-                        },
-                        "winning_conditions": {
-                            "type": "string",
-                            "description": "How to win the game"
+                        "total_cards": {
+                            "type": "integer",
+                            "description": "Total number of cards in the game"
                         }
-                    },
-                    "required": ["game_title", "objective", "cards", "setup", "gameplay", "winning_conditions"]
+                    }
+                },
+                "setup": {
+                    "type": "string",
+                    "description": "How to set up the game"
+                },
+                "gameplay": {
+                    "type": "string",
+                    "description": "How to play the game"
+                },
+                "winning_conditions": {
+                    "type": "string",
+                    "description": "How to win the game"
                 }
-            }
-        ]
-        
-        # Define card generation functions
-        self.card_functions = [
-            {
-                "name": "generate_card",
-                "description": "Generate content for a game card",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "title": {
-                            "type": "string",
-                            "description": "The title of the card"
-                        },
-                        "type": {
-                            "type": "string",
-                            "description": "The type of card (e.g., Action, Item)"
-                        },
-                        "description": {
-                            "type": "string",
-                            "description": "The card's effect or description"
+            },
+            "required": ["game_title", "objective", "cards", "setup", "gameplay", "winning_conditions"]
+        }
+    }
+]
+
+# Define card generation functions
+CARD_FUNCTIONS = [
+    {
+        "name": "generate_card",
+        "description": "Generate content for a game card",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string",
+                    "description": "The title of the card"
+                },
+                "type": {
+                    "type": "string",
+                    "description": "The type of card (e.g., Action, Item)"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "The card's effect or description"
+                },
+                "image_prompt": {
+                    "type": "string",
+                    "description": "A detailed prompt for DALL-E to generate the card's background image"
+                }
+            },
+            "required": ["title", "type", "description", "image_prompt"]
+        }
+    },
+    {
+        "name": "generate_cards",
+        "description": "Generate content for several distinct game cards at once",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "cards": {
+                    "type": "array",
+                    "description": "The generated cards, each with a different title and effect",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "title": {
+                                "type": "string",
+                                "description": "The title of the card"
+                            },
+                            "type": {
+                                "type": "string",
+                                "description": "The type of card (e.g., Action, Item)"
+                            },
+                            "description": {
+                                "type": "string",
+                                "description": "The card's effect or description"
+                            },
+                            "image_prompt": {
+                                "type": "string",
+                                "description": "A detailed prompt for DALL-E to generate the card's background image"
+                            }
                         },
-                        "image_prompt": {
-                            "type": "string",
-                            "description": "A detailed prompt for DALL-E to generate the card's background image"
-                        }
-                    },
-                    "required": ["title", "type", "description", "image_prompt"]
+                        "required": ["title", "type", "description", "image_prompt"]
+                    }
                 }
-            }
-        ]
+            },
+            "required": ["cards"]
+        }
+    }
+]
+
+@functools.cache
+def register_fonts():
+    """Register the PDF fonts; runs once per process"""
+    from reportlab.pdfbase import pdfmetrics
+    pdfmetrics.registerFont(pdfmetrics.Font('Helvetica', 'Helvetica', 'WinAnsiEncoding'))
+    pdfmetrics.registerFont(pdfmetrics.Font('Helvetica-Bold', 'Helvetica-Bold', 'WinAnsiEncoding'))
+    pdfmetrics.registerFontFamily(
+        'Helvetica',
+        normal='Helvetica',
+        bold='Helvetica-Bold',
+        italic='Helvetica',  # Fallback to normal since we don't have italic
+        boldItalic='Helvetica-Bold'  # Fallback to bold
+    )
 
-    async def generate_game_rules(self, game_concept):
-        print("DEBUG: Preparing to call OpenAI API for rules generation")
+@functools.cache
+def render_pool(workers):
+    """Return the process pool shared by every deck this process renders with `workers` processes"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # Decks are written from a worker thread while the event loop and the HTTP client's
+    # threads are running, and forking a multi-threaded process can deadlock the child
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+@functools.cache
+def card_text_style():
+    """The paragraph style of card descriptions, built once per process"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+    return ParagraphStyle(
+        'CardText',
+        fontSize=10,
+        leading=12,
+        textColor=colors.black,
+        fontName='Helvetica',
+        alignment=1  # Center alignment for better look
+    )
+
+class CardGenerator:
+    def __init__(self, api_key, cache=None, temp_files=False, http_limit=32, http_limit_per_host=16,
+                 http_timeout=120, limits=None, base_url=None, metrics=None, image_reuse=None,
+                 rules_model="gpt-4o", card_model="gpt-4o", image_model="dall-e-3", image_size="1024x1024",
+                 placeholder_images=False):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None  # AsyncOpenAI client, created on first use
+        self.cache = cache  # Optional ResponseCache shared by chat and image requests
+        self.limits = limits or RateLimiter()
+        
+        # Stage timings, token usage, retries and fallbacks; see metrics.RunMetrics
+        self.metrics = metrics or RunMetrics()
+        self.limits.attach_metrics(self.metrics)
+        
+        # Which cards share a background, unless a call passes its own (per-game) ImageReuse
+        self.image_reuse = image_reuse or ImageReuse()
+        
+        # Models and image size per stage; with placeholder_images, cards get a local
+        # gradient per card type instead of a generated image (e.g. for drafts)
+        self.rules_model = rules_model
+        self.card_model = card_model
+        self.image_model = image_model
+        self.image_size = image_size
+        self.placeholder_images = placeholder_images
+        
+        # One pooled HTTP session for image downloads, closed by aclose()
+        self.http_limit = http_limit
+        self.http_limit_per_host = http_limit_per_host
+        self.http_timeout = http_timeout
+        self._session = None
+        
+        # Backgrounds are kept as in-memory buffers unless temp files are requested;
+        # any temp files created are tracked so cleanup() can delete them
+        self.temp_files = temp_files
+        self._temp_paths = []
+        self._fallback_paths = {}
+        self.cards_per_page = 9  # 3x3 grid
+        self.card_width = A4[0] / 3
+        self.card_height = A4[1] / 3
+        # Optional reportlab border colour per card type name; each colour gets its own card frame
+        self.type_colors = {}
+        
+        # Function schemas for GPT-4o, shared by every generator
+        self.rules_functions = RULES_FUNCTIONS
+        self.card_functions = CARD_FUNCTIONS
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            # Retries are handled by `limits`, so the SDK's own retries are disabled
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    async def generate_game_rules(self, game_concept, on_card_type=None):
+        """Generate the rules for `game_concept` and return (rules_text, card_types, rules).
+
+        `rules` is the structured rules dict the text and card types were taken from.
+
+        With `on_card_type`, the response is streamed and `on_card_type(card_type)` is
+        called for each card type, in order, as soon as it has arrived, so card generation
+        can start while the rest of the rules are still being written.
+        """
+        logger.debug("Preparing to call OpenAI API for rules generation")
+        parser = None
+        if on_card_type is not None:
+            parser = ArrayItemParser('card_types', on_card_type)
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": """You are a professional card game designer. 
-                    Create clear, concise rules for a card-only game (no board, no dice, just cards).
-                    Design a balanced and engaging game with an appropriate number of cards."""},
-                    {"role": "user", "content": f"Create rules for this card game concept: {game_concept}"}
-                ],
-                functions=self.rules_functions,
-                function_call={"name": "define_game_rules"}
-            )
-            
-            print("DEBUG: Received response from OpenAI")
-            function_args = json.loads(response.choices[0].message.function_call.arguments)
-            
-            print(f"DEBUG: Card distribution: {json.dumps(function_args['cards'], indent=2)}")
+            with self.metrics.stage('rules'):
+                function_args = await self._call_function(
+                    model=self.rules_model,
+                    messages=[
+                        {"role": "system", "content": """You are a professional card game designer. 
+                        Create clear, concise rules for a card-only game (no board, no dice, just cards).
+                        Design a balanced and engaging game with an appropriate number of cards."""},
+                        {"role": "user", "content": f"Create rules for this card game concept: {game_concept}"}
+                    ],
+                    function=self.rules_functions[0],
+                    stream_parser=parser
+                )
+            if parser is not None:
+                parser.finish(function_args['cards']['card_types'])
             
-            # Store card specifications for later use
-            self.card_specs = function_args['cards']['card_types']
+            logger.debug("Received response from OpenAI")
+            logger.debug("Card distribution: %s", json.dumps(function_args['cards'], indent=2))
             
             # Format rules for PDF
             rules_text = self._format_rules_for_pdf(function_args)
-            return rules_text, function_args['cards']['card_types']
+            return rules_text, function_args['cards']['card_types'], function_args
             
-        except Exception as e:
-            print(f"ERROR in generate_game_rules: {str(e)}")
-            print("DEBUG: Full exception:")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Rules generation failed")
             raise
 
     def _format_rules_for_pdf(self, rules_data):
@@ -190,93 +344,361 @@ Total Cards: {rules_data['cards']['total_cards']}
         return '\n'.join([f"- {card['quantity']} {card['type']} Cards: {card['description']}" 
                          for card in card_types])
 
-    async def generate_cards_content(self, game_concept, num_cards, card_type, max_retries=3):
-        for attempt in range(max_retries):
-            try:
-                print(f"DEBUG: Starting card generation attempt {attempt + 1} for {card_type['type']}")
-                response = await self.client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system", 
-                            "content": f"""You are a card game designer specializing in card-only games. 
-                            Generate a {card_type['type']} card that matches this description: {card_type['description']}.
-                            For the image_prompt, create a family-friendly, safe-for-work image description.
-                            The image should be clear, visually striking, and suitable for a card game.
-                            Avoid any potentially controversial or adult themes."""
-                        },
-                        {"role": "user", "content": f"Generate {num_cards} card(s) for this card-only game concept: {game_concept}"}
-                    ],
-                    functions=self.card_functions,
-                    function_call={"name": "generate_card"}
-                )
-                
-                function_args = json.loads(response.choices[0].message.function_call.arguments)
-                print(f"DEBUG: Successfully generated card content on attempt {attempt + 1}")
-                return [function_args]
-                
-            except Exception as e:
-                print(f"ERROR in generate_cards_content attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise
-                print("Retrying card generation...")
-                await asyncio.sleep(1)  # Wait a bit before retrying
+    async def generate_cards_content(self, game_concept, num_cards, card_type, max_retries=3, cache_variant=None):
+        """Generate `num_cards` cards of `card_type`.
+
+        A single card uses the `generate_card` function; larger requests use the batched
+        `generate_cards` function so the whole batch costs one chat call. Cards missing
+        from a short or partly invalid batch are requested again on the next attempt.
 
-    async def generate_card_background(self, prompt, max_retries=3):
+        Identical requests for different cards of the same type should pass a distinct
+        `cache_variant` (e.g. the card's index) so they don't share one cached response.
+
+        `max_retries` bounds the attempts at getting valid card content; transient API
+        errors are retried separately by the generator's rate limiter.
+        """
+        cards = []
         for attempt in range(max_retries):
+            remaining = num_cards - len(cards)
             try:
-                print(f"DEBUG: Starting background generation attempt {attempt + 1}")
-                # Sanitize the prompt to avoid content policy violations
-                safe_prompt = f"A family-friendly, cartoon-style illustration for a card game showing: {prompt}"
-                
-                response = await self.client.images.generate(
-                    model="dall-e-3",
-                    prompt=safe_prompt,
-                    size="1024x1024",
-                    quality="standard",
-                    n=1
-                )
-                
-                image_url = response.data[0].url
-                print(f"DEBUG: Successfully generated image on attempt {attempt + 1}")
+                logger.debug("Starting card generation attempt %d for %d %s card(s)", attempt + 1, remaining, card_type['type'])
+                function = self._card_function("generate_card" if remaining == 1 else "generate_cards")
+                def extract(function_args, remaining=remaining):
+                    generated = [function_args] if remaining == 1 else function_args.get('cards', [])
+                    return self._validate_cards(generated)[:remaining]
+
+                with self.metrics.stage('card_text', cards=remaining):
+                    function_args = await self._call_function(
+                        model=self.card_model,
+                        messages=self._card_messages(game_concept, remaining, card_type, cards),
+                        function=function,
+                        cache_variant=cache_variant,
+                        # A cached short or malformed batch would be served again on every retry
+                        cache_if=lambda function_args: len(extract(function_args)) == remaining
+                    )
                 
-                # Download and save image
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as img_response:
-                        image_data = await img_response.read()
+                valid = extract(function_args)
+                cards.extend(valid)
+                if len(cards) < num_cards:
+                    raise ValueError(f"Expected {remaining} valid card(s), got {len(valid)}")
                 
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-                temp_file.write(image_data)
-                temp_file.close()
-                return temp_file.name
+                logger.debug("Successfully generated card content on attempt %d", attempt + 1)
+                return cards
                 
-            except Exception as e:
-                print(f"ERROR in generate_card_background attempt {attempt + 1}: {str(e)}")
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                # Malformed or incomplete function arguments; ask again right away
+                logger.warning("Invalid card content on attempt %d: %s", attempt + 1, e)
                 if attempt == max_retries - 1:
-                    # If all retries failed, use a default background
-                    print("WARNING: Using fallback background after all retries failed")
-                    return self._create_fallback_background()
-                print("Retrying background generation...")
-                await asyncio.sleep(1)
-
-    def _create_fallback_background(self):
-        """Create a simple gradient background when image generation fails"""
-        img = Image.new('RGB', (1024, 1024), color='white')
-        draw = ImageDraw.Draw(img)
+                    raise
+                self.metrics.increment('content_retries')
+
+    async def _call_function(self, model, messages, function, cache_variant=None, stream_parser=None, cache_if=None):
+        """Force a call to `function` and return its parsed arguments, served from the cache when possible.
+
+        With a `stream_parser`, the response is streamed and the arguments are fed to
+        `stream_parser.feed()` as they arrive. With `cache_if`, a fresh response is only
+        cached when `cache_if(arguments)` is true.
+        """
+        request = {
+            "model": model,
+            "messages": messages,
+            "functions": [function],
+            "function_call": {"name": function['name']}
+        }
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(variant=cache_variant, **request)
+            cached = self.cache.get_json(cache_key)
+            if cached is not None:
+                logger.debug("Using cached %s response", function['name'])
+                self.metrics.increment('cache_hits')
+                return cached
+            self.metrics.increment('cache_misses')
+
+        if stream_parser is not None:
+            arguments, usage = await self._stream_arguments(request, stream_parser)
+        else:
+            raw_response = await self.limits['chat'].call(
+                lambda: self.client.chat.completions.with_raw_response.create(**request),
+                tokens=self._estimate_tokens(request)
+            )
+            response = raw_response.parse()
+            arguments, usage = response.choices[0].message.function_call.arguments, response.usage
+        self.metrics.increment('chat_requests')
+        if usage is not None:
+            self.metrics.increment('prompt_tokens', usage.prompt_tokens)
+            self.metrics.increment('completion_tokens', usage.completion_tokens)
+        function_args = json.loads(arguments)
+        if cache_key is not None and (cache_if is None or cache_if(function_args)):
+            self.cache.set_json(cache_key, function_args)
+        return function_args
+
+    async def _stream_arguments(self, request, stream_parser):
+        """Stream a function call, feeding its arguments to `stream_parser`; returns (arguments, usage)"""
+        # Only opening the stream is retried: once items have been handed to the
+        # parser, a second attempt could disagree with them
+        raw_response = await self.limits['chat'].call(
+            lambda: self.client.chat.completions.with_raw_response.create(
+                **request, stream=True, stream_options={"include_usage": True}
+            ),
+            tokens=self._estimate_tokens(request)
+        )
+        parts = []
+        usage = None
+        async for chunk in raw_response.parse():
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices or chunk.choices[0].delta.function_call is None:
+                continue
+            text = chunk.choices[0].delta.function_call.arguments
+            if text:
+                parts.append(text)
+                stream_parser.feed(text)
+        return ''.join(parts), usage
+
+    async def _generate_image(self, prompt, destination):
+        """Generate an image for `prompt` into the binary file object `destination`, served from the cache when possible"""
+        request = {
+            "model": self.image_model,
+            "prompt": prompt,
+            "size": self.image_size,
+            "n": 1
+        }
+        if self.image_model == "dall-e-3":
+            request["quality"] = "standard"
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(**request)
+            cached = self.cache.get_bytes(cache_key)
+            if cached is not None:
+                logger.debug("Using cached image")
+                self.metrics.increment('cache_hits')
+                destination.write(cached)
+                return
+            self.metrics.increment('cache_misses')
+
+        with self.metrics.stage('image_generation'):
+            raw_response = await self.limits['images'].call(
+                lambda: self.client.images.with_raw_response.generate(**request)
+            )
+        self.metrics.increment('image_requests')
+        image_url = raw_response.parse().data[0].url
+        
+        start = destination.tell()
+        async def download():
+            # Start over from scratch if an earlier attempt failed part-way through
+            destination.seek(start)
+            destination.truncate()
+            await self._download(image_url, destination)
+        with self.metrics.stage('image_download'):
+            await self.limits['download'].call(download)
+
+        if cache_key is not None:
+            destination.seek(start)
+            self.cache.set_bytes(cache_key, destination.read())
+
+    def _estimate_tokens(self, request):
+        # Roughly four characters per token, plus an allowance for the function call reply
+        prompt = json.dumps(request['messages']) + json.dumps(request.get('functions', []))
+        return len(prompt) // 4 + 1000
+
+    async def _download(self, url, destination, chunk_size=64 * 1024):
+        """Stream `url` into `destination` over the shared connection pool"""
+        async with self._http_session().get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                destination.write(chunk)
+
+    def _http_session(self):
+        # Created lazily so the session belongs to the running event loop
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.http_limit, limit_per_host=self.http_limit_per_host),
+                timeout=aiohttp.ClientTimeout(total=self.http_timeout, sock_connect=30)
+            )
+        return self._session
+
+    def _card_function(self, name):
+        return next(function for function in self.card_functions if function['name'] == name)
+
+    def _card_messages(self, game_concept, num_cards, card_type, existing_cards=()):
+        if num_cards == 1:
+            task = f"Generate a {card_type['type']} card that matches this description: {card_type['description']}."
+        else:
+            task = (f"Generate {num_cards} distinct {card_type['type']} cards that match this description: {card_type['description']}. "
+                    "Give every card its own title, effect and image_prompt.")
+        request = f"Generate {num_cards} card(s) for this card-only game concept: {game_concept}"
+        if existing_cards:
+            titles = ', '.join(card['title'] for card in existing_cards)
+            request += f"\nThese cards already exist, so do not repeat them: {titles}"
+        return [
+            {
+                "role": "system", 
+                "content": f"""You are a card game designer specializing in card-only games. 
+                            {task}
+                            For the image_prompt, create a family-friendly, safe-for-work image description.
+                            The image should be clear, visually striking, and suitable for a card game.
+                            Avoid any potentially controversial or adult themes."""
+            },
+            {"role": "user", "content": request}
+        ]
+
+    def _validate_cards(self, generated):
+        """Keep only well-formed card dicts, reduced to the fields the PDF layout uses"""
+        required = self._card_function("generate_card")['parameters']['required']
+        cards = []
+        for card in generated:
+            if not isinstance(card, dict):
+                continue
+            if all(isinstance(card.get(field), str) and card[field].strip() for field in required):
+                cards.append({field: card[field] for field in required})
+        return cards
+
+    async def generate_card_background(self, prompt, card_type=None, image_reuse=None):
+        """Generate a background for `prompt`.
+
+        Returns an io.BytesIO with the PNG data, or the path of a temp file if the
+        generator was created with temp_files=True. If image generation fails after the
+        rate limiter's retries, or its circuit breaker is open, a fallback gradient is
+        returned instead.
+
+        Cards that the `image_reuse` policy groups together (by `card_type`, the card's
+        type dict, or by prompt) share one image, which is generated only once even
+        when they ask for it at the same time. A fallback gradient is never shared.
+        Pass a per-game `image_reuse` (see ImageReuse.for_game()) to share images only
+        within one game; it defaults to the generator's.
+
+        With placeholder_images, no image is generated: every card of a type gets the
+        same local gradient.
+        """
+        if self.placeholder_images:
+            self.metrics.increment('placeholder_backgrounds')
+            return self._create_placeholder_background(card_type['type'] if card_type else '')
         
-        # Create a simple gradient background
-        for y in range(1024):
-            r = int(255 * (1 - y/1024))
-            g = int(200 * (1 - y/1024))
-            b = int(255 * (y/1024))
-            draw.line([(0, y), (1024, y)], fill=(r, g, b))
+        image_reuse = image_reuse or self.image_reuse
+        key, prompt = image_reuse.resolve(prompt, card_type)
+        if key is None:
+            return await self._generate_background(prompt)
         
-        # Save to temporary file
+        while (shared := image_reuse.shared.get(key)) is not None:
+            background = await asyncio.shield(shared)
+            if background is not None:
+                self.metrics.increment('reused_backgrounds')
+                # A temp file path, or the PNG bytes; each card gets its own buffer
+                return background if self.temp_files else io.BytesIO(background)
+            # The card generating it got no image; try again rather than share a fallback
+        shared = image_reuse.shared[key] = asyncio.get_running_loop().create_future()
+        try:
+            background = await self._render_background(prompt)
+        except BaseException as e:
+            # Let a later card try again instead of sharing the failure
+            del image_reuse.shared[key]
+            shared.set_result(None)
+            if isinstance(e, Exception):
+                return self._fallback_background(e)
+            raise
+        shared.set_result(background if self.temp_files else background.getvalue())
+        return background
+
+    async def _generate_background(self, prompt):
+        try:
+            return await self._render_background(prompt)
+        except Exception as e:
+            return self._fallback_background(e)
+
+    async def _render_background(self, prompt):
+        logger.debug("Starting background generation")
+        # Sanitize the prompt to avoid content policy violations
+        safe_prompt = f"A family-friendly, cartoon-style illustration for a card game showing: {prompt}"
+        if self.temp_files:
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
+            self._temp_paths.append(temp_file.name)
+            with temp_file:
+                await self._generate_image(safe_prompt, temp_file)
+            background = temp_file.name
+        else:
+            background = io.BytesIO()
+            await self._generate_image(safe_prompt, background)
+            background.seek(0)
+        logger.debug("Successfully generated image")
+        return background
+
+    def _fallback_background(self, error):
+        if isinstance(error, CircuitOpenError):
+            logger.warning("Using fallback background: %s", error)
+        else:
+            logger.error("Background generation failed, using fallback background: %s", error)
+        self.metrics.increment('fallback_backgrounds')
+        return self._create_fallback_background()
+
+    def _create_fallback_background(self, top_color=(255, 200, 0), bottom_color=(0, 0, 255)):
+        """Return a gradient background for when image generation fails.
+
+        Each colour pair is rendered once per process, and written to at most one temp
+        file per generator; later fallbacks reuse the same image.
+        """
+        key = (tuple(top_color), tuple(bottom_color))
+        if key not in _fallback_backgrounds:
+            from PIL import Image
+            # Build the gradient as per-channel lookups on one vertical ramp
+            ramp = Image.linear_gradient('L').resize((1024, 1024), Image.BILINEAR)
+            channels = [
+                ramp.point(lambda v, top=top, bottom=bottom: round(top + (bottom - top) * v / 255))
+                for top, bottom in zip(top_color, bottom_color)
+            ]
+            output = io.BytesIO()
+            Image.merge('RGB', channels).save(output, format='PNG')
+            _fallback_backgrounds[key] = output.getvalue()
+        
+        if not self.temp_files:
+            return io.BytesIO(_fallback_backgrounds[key])
+        if key not in self._fallback_paths:
+            self._fallback_paths[key] = self._write_temp_file(_fallback_backgrounds[key])
+        return self._fallback_paths[key]
+
+    def _create_placeholder_background(self, type_name):
+        """Return the fallback gradient in colours picked from `type_name`, the same for every run"""
+        hue = int(hashlib.sha256(type_name.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+        top_color, bottom_color = (
+            tuple(round(channel * 255) for channel in colorsys.hsv_to_rgb(hue, saturation, value))
+            for saturation, value in ((0.35, 1.0), (0.9, 0.55))
+        )
+        return self._create_fallback_background(top_color, bottom_color)
+
+    def _write_temp_file(self, image_data):
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        img.save(temp_file.name)
+        temp_file.write(image_data)
         temp_file.close()
+        self._temp_paths.append(temp_file.name)
         return temp_file.name
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the HTTP connection pools and delete temp files"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        self.cleanup()
+
+    def cleanup(self):
+        """Delete every temp file this generator created"""
+        for path in self._temp_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._temp_paths = []
+        self._fallback_paths = {}
+
     def _format_markdown_text(self, markdown_text):
         # Split sections by double newlines
         sections = markdown_text.split('**')
@@ -305,103 +727,304 @@ Total Cards: {rules_data['cards']['total_cards']}
         return text
 
     def create_rules_pdf(self, rules, output_file):
-        # Format the text
-        formatted_rules = self._format_markdown_text(rules)
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.pdfgen import canvas
+        from reportlab.platypus import Paragraph
+        register_fonts()
+        with self.metrics.stage('rules_pdf'):
+            # Format the text
+            formatted_rules = self._format_markdown_text(rules)
         
-        c = canvas.Canvas(output_file, pagesize=A4)
-        styles = getSampleStyleSheet()
+            c = canvas.Canvas(output_file, pagesize=A4)
+            styles = getSampleStyleSheet()
         
-        # Create custom styles for different text types
-        header_style = ParagraphStyle(
-            'HeaderStyle',
-            parent=styles['Normal'],
-            fontSize=16,
-            leading=20,
-            spaceBefore=15,
-            spaceAfter=10,
-            fontName='Helvetica-Bold'
-        )
+            # Create custom styles for different text types
+            header_style = ParagraphStyle(
+                'HeaderStyle',
+                parent=styles['Normal'],
+                fontSize=16,
+                leading=20,
+                spaceBefore=15,
+                spaceAfter=10,
+                fontName='Helvetica-Bold'
+            )
         
-        body_style = ParagraphStyle(
-            'BodyStyle',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=14,
-            spaceBefore=6,
-            spaceAfter=6,
-            bulletIndent=20,
-            leftIndent=20
-        )
+            body_style = ParagraphStyle(
+                'BodyStyle',
+                parent=styles['Normal'],
+                fontSize=12,
+                leading=14,
+                spaceBefore=6,
+                spaceAfter=6,
+                bulletIndent=20,
+                leftIndent=20
+            )
         
-        # Split into paragraphs and create a story
-        story = []
-        paragraphs = formatted_rules.split('\n\n')
+            # Split into paragraphs and create a story
+            story = []
+            paragraphs = formatted_rules.split('\n\n')
         
-        for para in paragraphs:
-            if para.strip().isupper() or '**' in para:  # Headers
-                story.append(Paragraph(para.replace('**', ''), header_style))
-            else:
-                story.append(Paragraph(para, body_style))
+            for para in paragraphs:
+                if para.strip().isupper() or '**' in para:  # Headers
+                    story.append(Paragraph(para.replace('**', ''), header_style))
+                else:
+                    story.append(Paragraph(para, body_style))
         
-        # Build the PDF
-        current_y = A4[1] - 50
-        for element in story:
-            w, h = element.wrap(A4[0] - 100, current_y)
-            if current_y - h <= 50:  # Check if we need a new page
-                c.showPage()
-                current_y = A4[1] - 50
-            element.drawOn(c, 50, current_y - h)
-            current_y -= h + 10
+            # Build the PDF
+            current_y = A4[1] - 50
+            for element in story:
+                w, h = element.wrap(A4[0] - 100, current_y)
+                if current_y - h <= 50:  # Check if we need a new page
+                    c.showPage()
+                    current_y = A4[1] - 50
+                element.drawOn(c, 50, current_y - h)
+                current_y -= h + 10
         
-        c.save()
+            c.save()
+
+    def create_card_pdf(self, cards_data, output_file, dpi=150, jpeg_quality=85, workers=1):
+        """Lay the cards out on a 3x3 grid per A4 page; see open_deck() for the options"""
+        with self.metrics.stage('cards_pdf'):
+            writer = self.open_deck(output_file, dpi=dpi, jpeg_quality=jpeg_quality, workers=workers)
+            try:
+                for index, card in enumerate(cards_data):
+                    writer.add_card(index, card, hold_pages=True)
+            except BaseException:
+                writer.discard()
+                raise
+            writer.close()
 
-    def create_card_pdf(self, cards_data, output_file):
-        c = canvas.Canvas(output_file, pagesize=A4)
-        current_card = 0
+    def open_deck(self, output_file, dpi=150, jpeg_quality=85, workers=1):
+        """Start writing a cards PDF incrementally; returns a DeckWriter.
+
+        Backgrounds are cropped to the card's aspect ratio, resampled to `dpi` and
+        embedded as JPEGs of `jpeg_quality`; images with identical content are embedded
+        once. Pass dpi=None to embed the original images unchanged.
+
+        With `workers` > 1, backgrounds are resampled in a pool of that many processes,
+        a bounded number of cards ahead of the page being written.
+
+        The border and text panels are defined once per colour as a form XObject and
+        stamped onto each card, so the file holds one copy of them.
+        """
+        return DeckWriter(self, output_file, dpi=dpi, jpeg_quality=jpeg_quality, workers=workers)
+
+    def _draw_card(self, c, card, position, background, frames):
+        """Draw `card` at grid `position` of the current page"""
+        from reportlab.lib import colors
+        from reportlab.platypus import Paragraph
+        x = (position % 3) * self.card_width
+        y = A4[1] - (position // 3 + 1) * self.card_height
         
-        for card in cards_data:
-            x = (current_card % 3) * self.card_width
-            y = A4[1] - ((current_card // 3) % 3 + 1) * self.card_height
-            
-            # Draw card border
+        # Place background image
+        c.drawImage(background, x, y, self.card_width, self.card_height)
+        
+        # Stamp the border and the semi-transparent title and description panels
+        frame = self._card_frame(c, self.type_colors.get(card['type'], colors.black), frames)
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(frame)
+        c.restoreState()
+        
+        # Add text
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(x + 10, y + self.card_height - 20, card['title'])
+        
+        # Add card type
+        c.setFont("Helvetica", 10)
+        c.drawString(x + 10, y + self.card_height - 35, card['type'])
+        
+        # Add description with text wrapping
+        p = Paragraph(card['description'], card_text_style())
+        p.wrapOn(c, self.card_width - 20, self.card_height - 60)
+        p.drawOn(c, x + 10, y + 15)  # Slightly higher position
+
+    def _card_frame(self, c, border_color, frames):
+        """Return the name of the form XObject holding the card frame, defining it on first use"""
+        from reportlab.lib import colors
+        from reportlab.pdfbase import pdfdoc
+        key = border_color.hexval()
+        if key not in frames:
+            name = f"card_frame_{len(frames)}"
+            c.beginForm(name, lowerx=-1, lowery=-1, upperx=self.card_width + 1, uppery=self.card_height + 1)
             c.setStrokeColor(colors.black)
-            c.rect(x, y, self.card_width, self.card_height)
-            
-            # Place background image
-            c.drawImage(card['background'], x, y, self.card_width, self.card_height)
             
             # Create semi-transparent white background for title area
             c.setFillColor(colors.white.clone(alpha=0.7))  # More opaque for title
-            c.rect(x + 5, y + self.card_height - 45, self.card_width - 10, 40, fill=True)
+            c.rect(5, self.card_height - 45, self.card_width - 10, 40, fill=True)
             
             # Create semi-transparent white background for description area
             c.setFillColor(colors.white.clone(alpha=0.8))  # More opaque for text
-            c.rect(x + 5, y + 5, self.card_width - 10, self.card_height - 55, fill=True)
-            
-            # Add text
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(x + 10, y + self.card_height - 20, card['title'])
+            c.rect(5, 5, self.card_width - 10, self.card_height - 55, fill=True)
             
-            # Add card type
-            c.setFont("Helvetica", 10)
-            c.drawString(x + 10, y + self.card_height - 35, card['type'])
-            
-            # Add description with text wrapping
-            style = ParagraphStyle(
-                'CardText',
-                fontSize=10,
-                leading=12,
-                textColor=colors.black,
-                fontName='Helvetica',
-                alignment=1  # Center alignment for better look
-            )
-            p = Paragraph(card['description'], style)
-            p.wrapOn(c, self.card_width - 20, self.card_height - 60)
-            p.drawOn(c, x + 10, y + 15)  # Slightly higher position
+            # Draw card border
+            c.setStrokeColor(border_color)
+            c.rect(0, 0, self.card_width, self.card_height)
             
-            current_card += 1
-            if current_card % self.cards_per_page == 0:
-                c.showPage()
+            # reportlab leaves the transparency states out of a form's resources, which
+            # makes the panels opaque in strict viewers, so declare the resources here
+            resources = pdfdoc.PDFResourceDictionary(ExtGState=c._extgstate.getState() or {})
+            resources.basicFonts()
+            resources.allProcs()
+            c.endForm(Resources=resources)
+            frames[key] = name
+        return frames[key]
+
+    def _prepare_background(self, source, dpi, jpeg_quality, prepared):
+        """Return a print-ready ImageReader for `source`, reusing `prepared` for duplicate images.
+
+        `prepared` is an OrderedDict of content digest -> JPEG bytes, kept to the most
+        recent `cards_per_page` images; the canvas already holds every image it embedded.
+        """
+        from reportlab.lib.utils import ImageReader
+        if dpi is None:
+            return ImageReader(source) if isinstance(source, io.BytesIO) else source
+        
+        image_data = read_image_bytes(source)
+        digest = hashlib.sha256(image_data).hexdigest()
+        if digest in prepared:
+            prepared.move_to_end(digest)
+        else:
+            prepared[digest] = resample_background(image_data, (self.card_width, self.card_height), dpi, jpeg_quality)
+            if len(prepared) > self.cards_per_page:
+                prepared.popitem(last=False)
+        # A reader keeps the decoded pixels, so only the JPEG bytes are kept between cards
+        return ImageReader(io.BytesIO(prepared[digest]))
+
+
+class DeckWriter:
+    """Writes a cards PDF page by page while the cards are still being generated.
+
+    Cards may be added in any order; each page is laid out as soon as all of its cards
+    have arrived, after which the writer drops its references to their backgrounds.
+    Call close() once every card has been added to write the last page and the file,
+    or discard() to give up without writing it.
+
+    With a process pool, at most a page plus two cards per worker are resampling or
+    waiting to be written at a time.
+    """
+
+    def __init__(self, generator, output_file, dpi=150, jpeg_quality=85, workers=1):
+        self.generator = generator
+        self.output_file = output_file
+        self.dpi = dpi
+        self.jpeg_quality = jpeg_quality
+        self.pages = 0
+        from reportlab.pdfgen import canvas
+        register_fonts()
+        self._canvas = canvas.Canvas(output_file, pagesize=A4)
+        self._pending = {}  # Deck index -> card waiting for the rest of its page
+        self._next_index = 0  # First card of the next page to write
+        self._prepared = collections.OrderedDict()  # Content digest -> JPEG bytes of recent images
+        self._frames = {}
+        self._unsubmitted = []  # Heap of pending deck indices not yet sent to the pool
+        self._submitted = 0  # Pending cards sent to the pool
+        self._resampling = {}  # Content digest -> future of its JPEG bytes
+        self._uses = collections.Counter()  # Content digest -> pending cards drawn with it
+        self._pool = None
+        if workers > 1 and dpi is not None:
+            self._pool = render_pool(workers)
+            self._window = generator.cards_per_page + 2 * workers
+
+    def add_card(self, index, card, hold_pages=False):
+        """Add the card at deck position `index`, writing every page this completes.
+
+        With `hold_pages`, complete pages wait until the pool's window is full, so a
+        caller adding a whole deck at once keeps the pool busy while pages are laid out.
+        """
+        if index < self._next_index or index in self._pending:
+            raise ValueError(f"Card {index} was already added")
+        self._pending[index] = card
+        if self._pool is not None:
+            heapq.heappush(self._unsubmitted, index)
+            self._submit_ahead()
         
-        c.save() 
\ No newline at end of file
+        cards_per_page = self.generator.cards_per_page
+        while self._page_complete(cards_per_page):
+            if hold_pages and self._pool is not None and self._submitted < self._window:
+                break
+            self._write_page(cards_per_page)
+
+    def close(self):
+        """Write the remaining pages and save the file"""
+        try:
+            if self._pending:
+                missing = [index for index in range(self._next_index, max(self._pending))
+                           if index not in self._pending]
+                if missing:
+                    raise ValueError(f"Cards {missing} were never added to '{self.output_file}'")
+                cards_per_page = self.generator.cards_per_page
+                while self._pending:
+                    self._write_page(min(cards_per_page, len(self._pending)))
+            with self.generator.metrics.stage('cards_pdf_save'):
+                self._canvas.save()
+        finally:
+            self._cancel_resampling()
+
+    def discard(self):
+        """Stop without saving the file"""
+        self._pending.clear()
+        self._cancel_resampling()
+
+    def _cancel_resampling(self):
+        # The pool is shared with other decks, so only drop this deck's work
+        for future in self._resampling.values():
+            future.cancel()
+        self._resampling.clear()
+        self._uses.clear()
+
+    def _page_complete(self, count):
+        return all(self._next_index + i in self._pending for i in range(count))
+
+    def _submit_ahead(self):
+        """Send the earliest cards' backgrounds to the pool until the window is full"""
+        while self._unsubmitted and self._submitted < self._window:
+            self._submit(heapq.heappop(self._unsubmitted))
+
+    def _submit(self, index):
+        card = self._pending[index]
+        image_data = read_image_bytes(card['background'])
+        digest = hashlib.sha256(image_data).hexdigest()
+        if digest not in self._resampling:
+            if digest in self._prepared:
+                self._resampling[digest] = future = concurrent.futures.Future()
+                future.set_result(self._prepared[digest])
+            else:
+                size = (self.generator.card_width, self.generator.card_height)
+                self._resampling[digest] = self._pool.submit(resample_background, image_data, size, self.dpi,
+                                                             self.jpeg_quality)
+        self._uses[digest] += 1
+        self._submitted += 1
+        self._pending[index] = dict(card, background=digest)
+
+    def _write_page(self, count):
+        with self.generator.metrics.stage('cards_pdf_page'):
+            # The page's cards come first in the heap; send any the window held back
+            while self._unsubmitted and self._unsubmitted[0] < self._next_index + count:
+                self._submit(heapq.heappop(self._unsubmitted))
+            for position in range(count):
+                card = self._pending.pop(self._next_index + position)
+                background = self._background(card['background'])
+                self.generator._draw_card(self._canvas, card, position, background, self._frames)
+            self._canvas.showPage()
+        self._next_index += count
+        self.pages += 1
+        if self._pool is not None:
+            self._submit_ahead()
+
+    def _background(self, source):
+        if self._pool is None:
+            return self.generator._prepare_background(source, self.dpi, self.jpeg_quality, self._prepared)
+        from reportlab.lib.utils import ImageReader
+        jpeg = self._resampling[source].result()
+        self._submitted -= 1
+        self._uses[source] -= 1
+        if not self._uses[source]:
+            # No pending card needs it; keep it among the recent images for repeats
+            del self._uses[source], self._resampling[source]
+            self._prepared[source] = jpeg
+            self._prepared.move_to_end(source)
+            if len(self._prepared) > self.generator.cards_per_page:
+                self._prepared.popitem(last=False)
+        return ImageReader(io.BytesIO(jpeg))
@@ -0,0 +1,17 @@
+import os
+
+# mkstemp creates files only their owner can read; read the umask once, while the
+# process is still single-threaded, so replacements get the mode open() would give them
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def replace_file(temp_path, path):
+    """Move a finished temp file over `path`, keeping the mode of the file it replaces"""
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = FILE_MODE
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
@@ -0,0 +1,67 @@
+import difflib
+import re
+
+POLICIES = ('unique', 'per-type', 'prompt', 'similar')
+
+
+class ImageReuse:
+    """Decides which cards can share one generated background.
+
+    Policies:
+      'unique'   every card gets its own image
+      'per-type' one image per card type, drawn from the type's description
+      'prompt'   cards whose image prompts match after normalization share an image
+      'similar'  like 'prompt', but prompts at least `threshold` similar (difflib ratio) match too
+
+    An instance remembers every prompt and image it has seen; use for_game() to give
+    each game of a batch its own, so images are only shared within a game.
+    """
+
+    def __init__(self, policy='unique', threshold=0.9):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown image reuse policy '{policy}', expected one of {', '.join(POLICIES)}")
+        if not 0 < threshold <= 1:
+            raise ValueError("The similarity threshold must be in (0, 1]")
+        self.policy = policy
+        self.threshold = threshold
+        self._prompts = []  # Normalized prompts seen so far, for 'similar'
+        self.shared = {}  # Reuse key -> future of the shared image, filled in by CardGenerator
+
+    def for_game(self):
+        """Return a new ImageReuse with the same policy and no shared state"""
+        return ImageReuse(self.policy, threshold=self.threshold)
+
+    def resolve(self, prompt, card_type=None):
+        """Return (key, prompt) for a card's background.
+
+        Cards that get the same key share one image, generated from the returned prompt;
+        a key of None means the card's image is not shared.
+        """
+        if self.policy == 'unique':
+            return None, prompt
+        if self.policy == 'per-type' and card_type is not None:
+            # The description keeps same-named types of different games apart
+            return ('type', card_type['type'], card_type['description']), (f"Artwork for the {card_type['type']} cards of a card game: "
+                                                 f"{card_type['description']}")
+        normalized = normalize_prompt(prompt)
+        if self.policy == 'similar':
+            normalized = self._closest(normalized)
+        return ('prompt', normalized), prompt
+
+    def _closest(self, normalized):
+        """Return the first earlier prompt similar enough to `normalized`, or remember it as a new one"""
+        # SequenceMatcher indexes its second sequence, so keep the new prompt there
+        matcher = difflib.SequenceMatcher(b=normalized, autojunk=False)
+        for seen in self._prompts:
+            matcher.set_seq1(seen)
+            # The quick ratios are upper bounds, so most prompts are rejected cheaply
+            if (matcher.real_quick_ratio() >= self.threshold and matcher.quick_ratio() >= self.threshold
+                    and matcher.ratio() >= self.threshold):
+                return seen
+        self._prompts.append(normalized)
+        return normalized
+
+
+def normalize_prompt(prompt):
+    """Lower-case a prompt and drop punctuation and repeated whitespace"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', prompt.lower()).split())
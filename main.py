@@ -1,76 +1,451 @@
 import asyncio
+import argparse
+import logging
 from card_generator import CardGenerator
+from cache import ResponseCache
+from image_reuse import ImageReuse, POLICIES
+from manifest import RunManifest
+from retry import RateLimiter, EndpointLimiter, RetryPolicy, CircuitBreaker
 import os
+import time
 from rich.console import Console
 from rich.progress import Progress
 import traceback
 
 console = Console()
 
-async def main():
+# Defaults that --draft switches to
+DRAFT_CARD_MODEL = "gpt-4o-mini"
+DRAFT_DPI = 50
+
+def add_generation_arguments(parser):
+    """Options shared by the interactive and batch entry points"""
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Maximum number of API requests in flight (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Cards of the same type generated by one chat request (default: %(default)s)")
+    parser.add_argument("--stream-rules", action="store_true",
+                        help="Stream the rules and start each card type as soon as it is known")
+    parser.add_argument("--draft", action="store_true",
+                        help="Quick preview: card text from %s, placeholder art per card type and a %d dpi "
+                             "cards.pdf; finish it later with --resume RUN_DIR --upgrade" % (DRAFT_CARD_MODEL, DRAFT_DPI))
+    parser.add_argument("--upgrade", action="store_true",
+                        help="Replace the placeholder art of a resumed draft with generated images, "
+                             "keeping its rules and card text")
+    parser.add_argument("--rules-model", default="gpt-4o", help="Chat model for the rules (default: gpt-4o)")
+    parser.add_argument("--card-model",
+                        help=f"Chat model for the card text (default: gpt-4o, or {DRAFT_CARD_MODEL} with --draft)")
+    parser.add_argument("--image-model", default="dall-e-3", help="Image model (default: dall-e-3)")
+    parser.add_argument("--image-size", default="1024x1024",
+                        help="Generated image size, as supported by the image model (default: 1024x1024)")
+    parser.add_argument("--placeholder-images", action="store_true",
+                        help="Don't generate images; give each card type a local gradient (implied by --draft)")
+    parser.add_argument("--image-reuse", choices=POLICIES, default="unique",
+                        help="Which cards share a background: unique art per card, one image per card type, "
+                             "or one per matching / similar image prompt (default: unique)")
+    parser.add_argument("--similarity", type=float, default=0.9,
+                        help="How similar two image prompts must be (0-1) to share an image with "
+                             "--image-reuse similar (default: 0.9)")
+    parser.add_argument("--cache-dir", default=".card_cache",
+                        help="Directory for cached API responses and images (default: .card_cache)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Cache size limit in MB; least recently used entries are evicted (default: 1024)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Neither read nor write the response cache")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached responses but store the new ones")
+    parser.add_argument("--dpi", type=int,
+                        help=f"Resolution card backgrounds are resampled to in cards.pdf "
+                             f"(default: 150, or {DRAFT_DPI} with --draft)")
+    parser.add_argument("--jpeg-quality", type=int, default=85,
+                        help="JPEG quality (1-95) of card backgrounds in cards.pdf (default: 85)")
+    parser.add_argument("--render-workers", type=int, default=1,
+                        help="Processes that resample card backgrounds for cards.pdf (default: 1)")
+    parser.add_argument("--temp-files", action="store_true",
+                        help="Pass backgrounds around as temp files instead of in-memory buffers")
+    parser.add_argument("--max-attempts", type=int, default=5,
+                        help="Attempts per API request before giving up (default: 5)")
+    parser.add_argument("--chat-rpm", type=int,
+                        help="Chat requests per minute allowed by your quota (default: unlimited)")
+    parser.add_argument("--chat-tpm", type=int,
+                        help="Chat tokens per minute allowed by your quota (default: unlimited)")
+    parser.add_argument("--image-rpm", type=int,
+                        help="Image requests per minute allowed by your quota (default: unlimited)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Show generator log messages at this level and above (default: none)")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Write a JSON report of stage timings, token usage, retries and fallbacks")
+    parser.add_argument("--prometheus", metavar="PATH",
+                        help="Write the same metrics in the Prometheus text format")
+
+def check_generation_arguments(parser, args):
+    if args.draft and args.upgrade:
+        parser.error("--draft and --upgrade can't be combined")
+    if args.draft:
+        args.placeholder_images = True
+    if args.upgrade and args.placeholder_images:
+        parser.error("--upgrade replaces placeholder images, so it can't be combined with --placeholder-images")
+    if args.card_model is None:
+        args.card_model = DRAFT_CARD_MODEL if args.draft else "gpt-4o"
+    if args.dpi is None:
+        args.dpi = DRAFT_DPI if args.draft else 150
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+    if args.dpi < 1:
+        parser.error("--dpi must be at least 1")
+    if not 0 < args.similarity <= 1:
+        parser.error("--similarity must be greater than 0 and at most 1")
+    if args.render_workers < 1:
+        parser.error("--render-workers must be at least 1")
+    if not 1 <= args.jpeg_quality <= 95:
+        parser.error("--jpeg-quality must be between 1 and 95")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a printable card game from a concept")
+    add_generation_arguments(parser)
+    run = parser.add_mutually_exclusive_group()
+    run.add_argument("--run-dir",
+                     help="Directory for this run's checkpoint manifest (default: runs/<timestamp>)")
+    run.add_argument("--resume", metavar="RUN_DIR",
+                     help="Resume an interrupted run, generating only the cards it is missing")
+    args = parser.parse_args()
+    check_generation_arguments(parser, args)
+    if args.upgrade and not args.resume:
+        parser.error("--upgrade needs --resume RUN_DIR of a draft run")
+    return args
+
+def build_rate_limiter(args):
+    retry = RetryPolicy(max_attempts=args.max_attempts)
+    return RateLimiter(
+        chat=EndpointLimiter('chat', requests_per_minute=args.chat_rpm, tokens_per_minute=args.chat_tpm,
+                             retry=retry),
+        images=EndpointLimiter('images', requests_per_minute=args.image_rpm, retry=retry,
+                               breaker=CircuitBreaker())
+    )
+
+def build_generator(args, api_key):
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024, refresh=args.refresh)
+    return CardGenerator(api_key, cache=cache, temp_files=args.temp_files, limits=build_rate_limiter(args),
+                         image_reuse=ImageReuse(args.image_reuse, threshold=args.similarity),
+                         rules_model=args.rules_model, card_model=args.card_model, image_model=args.image_model,
+                         image_size=args.image_size, placeholder_images=args.placeholder_images)
+
+def write_metrics(generator, args):
+    if args.report:
+        generator.metrics.write_json(args.report)
+    if args.prometheus:
+        generator.metrics.write_prometheus(args.prometheus)
+
+async def generate_chunk(generator, game_concept, card_type, slots, semaphore, progress, task, on_card_complete=None,
+                         image_reuse=None, label=''):
+    """Generate the text for one chunk of same-type cards in one request, then their backgrounds.
+
+    `slots` lists (deck index, position within the card type) for each card in the chunk.
+    Returns the finished cards as (deck index, card) pairs.
+    """
+    positions = [position for _, position in slots]
+    if len(slots) > 1:
+        chunk = f"{card_type['type']} cards {positions[0]+1}-{positions[-1]+1}"
+    else:
+        chunk = f"{card_type['type']} card {positions[0]+1}"
+
+    async with semaphore:
+        cards = await generator.generate_cards_content(game_concept, len(slots), card_type,
+                                                       cache_variant=positions[0])
+    progress.update(task, advance=len(cards))
+
+    async def add_background(index, card):
+        async with semaphore:
+            card['background'] = await generator.generate_card_background(card['image_prompt'], card_type,
+                                                                          image_reuse=image_reuse)
+            if generator.placeholder_images:
+                card['placeholder'] = True  # Lets --upgrade find the cards that still need art
+        if on_card_complete is not None:
+            card = on_card_complete(index, card)
+        generator.metrics.increment('cards_completed')
+        progress.update(task, advance=1)
+        return index, card
+
+    finished = await asyncio.gather(*(add_background(index, card) for (index, _), card in zip(slots, cards)))
+    console.print(f"[green]✓[/green] {label}{chunk} of {card_type['quantity']} complete")
+    return finished
+
+async def generate_deck(generator, game_concept, card_types, progress, task, concurrency=1, batch_size=1,
+                        completed=None, on_card_complete=None, semaphore=None, image_reuse=None, label=''):
+    """Generate every card in the deck with at most `concurrency` API requests in flight.
+
+    Each card type is split into chunks of up to `batch_size` cards that share one chat
+    request. Cards already in `completed` ({deck index: card}) are kept as they are, and
+    every newly finished card is passed to `on_card_complete(index, card)`, whose return
+    value replaces it. The returned list is in deck order (card types in rules order,
+    then card index), regardless of the order in which the requests finish.
+
+    Pass a shared `semaphore` to bound the requests of several decks generated at once,
+    and a per-game `image_reuse` so their cards don't share backgrounds across games;
+    `label` prefixes the deck's progress messages.
+
+    `card_types` may also be an asyncio.Queue that receives the card types while the
+    rules are still streaming in, followed by None; each type's cards are started as
+    soon as it arrives.
+    """
+    cards = dict(completed or {})
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    # Also cap the chunks in flight, so started cards get their backgrounds (and finish)
+    # before text requests for the rest of the deck queue up in front of them
+    chunk_semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(card_type, slots):
+        async with chunk_semaphore:
+            return await generate_chunk(generator, game_concept, card_type, slots, semaphore, progress, task,
+                                        on_card_complete, image_reuse=image_reuse, label=label)
+
+    workers = []
+    offset = 0
+    try:
+        async for card_type in _iterate_card_types(card_types):
+            missing = [(offset + position, position) for position in range(card_type['quantity'])
+                       if offset + position not in cards]
+            workers.extend(asyncio.create_task(worker(card_type, missing[i:i + batch_size]))
+                           for i in range(0, len(missing), batch_size))
+            offset += card_type['quantity']
+        results = await asyncio.gather(*workers)
+    except BaseException:
+        for pending in workers:
+            pending.cancel()
+        raise
+    for finished in results:
+        cards.update(finished)
+    return [cards[index] for index in range(offset)]
+
+async def _iterate_card_types(card_types):
+    if not isinstance(card_types, asyncio.Queue):
+        for card_type in card_types:
+            yield card_type
+        return
+    while True:
+        card_type = await card_types.get()
+        if card_type is None:
+            return
+        yield card_type
+
+async def generate_game(generator, manifest, args, progress, output_dir='.', semaphore=None, label=''):
+    """Generate the rules and cards for the concept in `manifest`, writing both PDFs to `output_dir`.
+
+    Progress is checkpointed to `manifest`, so rules and cards it already holds are reused.
+    cards.pdf is written page by page while the remaining cards are still generating.
+    Returns the paths of the rules and cards PDFs.
+    """
+    game_concept = manifest.concept
+    rules_path = os.path.join(output_dir, 'rules.pdf')
+    cards_path = os.path.join(output_dir, 'cards.pdf')
+
+    image_reuse = generator.image_reuse.for_game()
+    writer = generator.open_deck(cards_path, dpi=args.dpi, jpeg_quality=args.jpeg_quality,
+                                 workers=args.render_workers)
+    finished = asyncio.Queue()
+    pdf = asyncio.create_task(write_deck(writer, finished))
+    generation = asyncio.current_task()
+
+    def on_pdf_done(task):
+        # Stop spending API calls on cards that can't be written
+        if not task.cancelled() and task.exception() is not None:
+            generation.cancel()
+
+    pdf.add_done_callback(on_pdf_done)
+
+    def on_card_complete(index, card):
+        manifest.add_card(index, card)
+        # Hand the writer the saved copy of the background, so in-memory images are freed
+        # right away rather than kept until the rest of their page (or deck) is done
+        card = {key: value for key, value in card.items() if key != 'background'}
+        finished.put_nowait((index, dict(card, background=manifest.background_path(index))))
+        return card
+
+    try:
+        # Generate rules
+        task1 = progress.add_task(f"[cyan]{label}Generating game rules...", total=1)
+        if args.stream_rules and not manifest.has_rules:
+            await stream_game(generator, manifest, args, progress, task1, rules_path, on_card_complete,
+                              semaphore=semaphore, label=label, image_reuse=image_reuse)
+        else:
+            if manifest.has_rules:
+                rules_text, card_types = manifest.rules_text, manifest.card_types
+            else:
+                manifest.clear_cards()  # Cards from rules that were never saved don't belong to the new ones
+                rules_text, card_types, rules = await generator.generate_game_rules(game_concept)
+                manifest.set_rules(rules, rules_text, card_types)
+            progress.update(task1, advance=1)
+
+            # Save rules to PDF
+            generator.create_rules_pdf(rules_text, rules_path)
+            console.print(f"\n[green]✓[/green] {label}Rules generated and saved to '{rules_path}'")
+
+            # Get total cards from rules
+            total_cards = sum(card_type['quantity'] for card_type in card_types)
+            console.print(f"\n[cyan]{label}Generating {total_cards} cards ({args.concurrency} requests at a time)...[/cyan]")
+
+            # Generate cards and backgrounds, skipping any finished by an earlier run
+            completed = manifest.completed_cards()
+            drafts = {}
+            if args.upgrade:
+                drafts = {index: card for index, card in completed.items() if card.get('placeholder')}
+            if completed:
+                console.print(f"[cyan]{label}{len(completed)} cards already complete[/cyan]")
+                for index in sorted(completed):
+                    if index not in drafts:
+                        finished.put_nowait((index, completed[index]))
+            if drafts:
+                console.print(f"[cyan]{label}Generating art for {len(drafts)} draft cards, keeping their text[/cyan]")
+            task2 = progress.add_task(f"[cyan]{label}Generating cards and backgrounds...", total=total_cards * 2,
+                                      completed=len(completed) * 2 - len(drafts))
+            semaphore = semaphore or asyncio.Semaphore(args.concurrency)
+            await asyncio.gather(
+                generate_deck(generator, game_concept, card_types, progress, task2,
+                              concurrency=args.concurrency, batch_size=args.batch_size,
+                              completed=completed, on_card_complete=on_card_complete, semaphore=semaphore,
+                              image_reuse=image_reuse, label=label),
+                upgrade_cards(generator, drafts, card_types, semaphore, progress, task2, on_card_complete,
+                              image_reuse=image_reuse)
+            )
+
+        console.print(f"\n[cyan]{label}Finishing final PDF...[/cyan]")
+        finished.put_nowait(None)
+        await pdf
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        # Let the page being written finish, then drop the rest
+        while not finished.empty():
+            finished.get_nowait()
+        finished.put_nowait(None)
+        await asyncio.gather(pdf, return_exceptions=True)
+        writer.discard()
+        if not pdf.cancelled() and pdf.exception() is not None:
+            raise pdf.exception()  # Rather than the cancellation it caused
+        raise
+    return rules_path, cards_path
+
+async def upgrade_cards(generator, drafts, card_types, semaphore, progress, task, on_card_complete,
+                        image_reuse=None):
+    """Replace the placeholder backgrounds of `drafts` ({deck index: card}) with generated ones.
+
+    The cards keep their text; each upgraded card is passed to `on_card_complete(index, card)`.
+    """
+    types_by_index = []
+    for card_type in card_types:
+        types_by_index.extend([card_type] * card_type['quantity'])
+
+    async def upgrade(index, card):
+        card = {key: value for key, value in card.items() if key not in ('background', 'placeholder')}
+        async with semaphore:
+            card['background'] = await generator.generate_card_background(card['image_prompt'],
+                                                                          types_by_index[index],
+                                                                          image_reuse=image_reuse)
+        on_card_complete(index, card)
+        generator.metrics.increment('cards_upgraded')
+        progress.update(task, advance=1)
+
+    await asyncio.gather(*(upgrade(index, card) for index, card in drafts.items()))
+
+async def write_deck(writer, finished):
+    """Pass the (index, card) pairs from the `finished` queue to `writer` until None arrives.
+
+    The writer runs in a worker thread so laying out pages doesn't stall the API requests.
+    """
+    while True:
+        item = await finished.get()
+        if item is None:
+            return
+        await asyncio.to_thread(writer.add_card, *item)
+
+async def stream_game(generator, manifest, args, progress, rules_task, rules_path, on_card_complete,
+                      semaphore=None, label='', image_reuse=None):
+    """Stream the rules, starting each card type as soon as it arrives, and generate the cards.
+
+    The rules PDF is written in a worker thread while the cards are still being generated.
+    """
+    manifest.clear_cards()
+    card_types = asyncio.Queue()
+    total_cards = 0
+    cards_task = progress.add_task(f"[cyan]{label}Generating cards and backgrounds...", total=None)
+
+    def on_card_type(card_type):
+        nonlocal total_cards
+        total_cards += card_type['quantity']
+        progress.update(cards_task, total=total_cards * 2)
+        card_types.put_nowait(card_type)
+
+    deck = asyncio.create_task(generate_deck(generator, manifest.concept, card_types, progress, cards_task,
+                                             concurrency=args.concurrency, batch_size=args.batch_size,
+                                             on_card_complete=on_card_complete, semaphore=semaphore,
+                                             image_reuse=image_reuse, label=label))
+    try:
+        try:
+            rules_text, final_types, rules = await generator.generate_game_rules(manifest.concept,
+                                                                                 on_card_type=on_card_type)
+        finally:
+            card_types.put_nowait(None)
+        manifest.set_rules(rules, rules_text, final_types)
+        progress.update(rules_task, advance=1)
+        console.print(f"\n[cyan]{label}Generating {total_cards} cards ({args.concurrency} requests at a time)...[/cyan]")
+
+        await asyncio.to_thread(generator.create_rules_pdf, rules_text, rules_path)
+        console.print(f"\n[green]✓[/green] {label}Rules generated and saved to '{rules_path}'")
+        await deck
+    except BaseException:
+        deck.cancel()
+        await asyncio.gather(deck, return_exceptions=True)
+        raise
+
+async def main(args):
+    generator = None
+    manifest = None
     try:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             console.print("[red]Please set your OPENAI_API_KEY environment variable[/red]")
             return
-            
-        generator = CardGenerator(api_key)
-        
-        console.print("[bold green]Welcome to the Card Game Generator![/bold green]")
-        console.print("\nPlease describe your game concept:")
-        game_concept = input("> ")  # Single input point
-        
+
+        generator = build_generator(args, api_key)
+
+        if args.resume:
+            manifest = RunManifest.load(args.resume)
+            console.print(f"[bold green]Resuming run in '{args.resume}'[/bold green]")
+        else:
+            console.print("[bold green]Welcome to the Card Game Generator![/bold green]")
+            console.print("\nPlease describe your game concept:")
+            game_concept = input("> ")  # Single input point
+            run_dir = args.run_dir or os.path.join('runs', time.strftime('%Y%m%d-%H%M%S'))
+            manifest = RunManifest.create(run_dir, game_concept)
+            console.print(f"Checkpoints are saved to '{run_dir}' (continue later with --resume {run_dir})")
+
         console.print("\n[bold cyan]Starting generation process...[/bold cyan]")
         with Progress() as progress:
-            # Generate rules
-            task1 = progress.add_task("[cyan]Generating game rules...", total=1)
-            rules_text, card_types = await generator.generate_game_rules(game_concept)
-            progress.update(task1, advance=1)
-            
-            # Save rules to PDF
-            generator.create_rules_pdf(rules_text, 'rules.pdf')
-            console.print("\n[green]✓[/green] Rules generated and saved to 'rules.pdf'")
-            
-            # Get total cards from rules
-            total_cards = sum(card_type['quantity'] for card_type in card_types)
-            console.print(f"\n[cyan]Generating {total_cards} cards...[/cyan]")
-            
-            # Generate cards and backgrounds
-            task2 = progress.add_task("[cyan]Generating cards and backgrounds...", total=total_cards * 2)
-            
-            cards_data = []
-            for card_type in card_types:
-                console.print(f"\n[yellow]Generating {card_type['type']} cards ({card_type['quantity']})[/yellow]")
-                for i in range(card_type['quantity']):
-                    success = False
-                    while not success:
-                        try:
-                            console.print(f"[cyan]→ Card {i+1}/{card_type['quantity']}[/cyan]")
-                            card = await generator.generate_cards_content(game_concept, 1, card_type)
-                            cards_data.extend(card)
-                            progress.update(task2, advance=1)
-                            
-                            console.print(f"[cyan]→ Background {i+1}[/cyan]")
-                            cards_data[-1]['background'] = await generator.generate_card_background(cards_data[-1]['image_prompt'])
-                            progress.update(task2, advance=1)
-                            
-                            console.print(f"[green]✓[/green] Card {i+1} complete")
-                            success = True
-                        except Exception as e:
-                            console.print(f"[red]Failed to generate card {i+1}. Retrying...[/red]")
-                            if len(cards_data) > 0 and 'background' not in cards_data[-1]:
-                                cards_data.pop()  # Remove incomplete card
-                            await asyncio.sleep(1)
-            
-            console.print("\n[cyan]Creating final PDF...[/cyan]")
-            generator.create_card_pdf(cards_data, 'cards.pdf')
+            rules_path, cards_path = await generate_game(generator, manifest, args, progress)
             console.print("\n[green bold]✓ Generation complete![/green bold]")
-            console.print("Files created: rules.pdf, cards.pdf")
+            console.print(f"Files created: {rules_path}, {cards_path}")
 
     except Exception as e:
         console.print(f"\n[red bold]ERROR:[/red bold] {str(e)}")
         console.print("[red]Traceback:[/red]")
         console.print(traceback.format_exc())
+        if manifest is not None:
+            console.print(f"Finished cards are saved; continue with --resume {manifest.run_dir}")
+    finally:
+        if generator is not None:
+            await generator.aclose()
+            write_metrics(generator, args)
+
+def configure_logging(args):
+    if args.log_level:
+        logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    args = parse_args()
+    configure_logging(args)
+    asyncio.run(main(args))
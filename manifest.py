@@ -0,0 +1,157 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from fileutil import replace_file
+
+
+class RunManifest:
+    """Checkpoint of one deck generation run.
+
+    The run directory holds `manifest.json` (game concept and rules), `cards.jsonl`
+    (one line per completed card) and a `backgrounds/` folder with one image per
+    completed card. The manifest is rewritten atomically when the rules change, and
+    cards are appended to the card log, so an interrupted run can be resumed from
+    whatever it had finished without rewriting every earlier card for each new one.
+    """
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, 'manifest.json')
+        self.cards_path = os.path.join(run_dir, 'cards.jsonl')
+        self.data = {
+            "concept": None,
+            "rules": None,
+            "rules_text": None,
+            "card_types": None,
+            "cards": {}
+        }
+
+    @classmethod
+    def create(cls, run_dir, concept):
+        os.makedirs(os.path.join(run_dir, 'backgrounds'), exist_ok=True)
+        manifest = cls(run_dir)
+        manifest.data['concept'] = concept
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, run_dir):
+        manifest = cls(run_dir)
+        with open(manifest.path, encoding='utf-8') as f:
+            manifest.data = json.load(f)
+        os.makedirs(os.path.join(run_dir, 'backgrounds'), exist_ok=True)
+        # Earlier manifests kept the cards inline; move them to the card log
+        inline = manifest.data.get('cards') or {}
+        manifest.data['cards'] = manifest._read_card_log()
+        for index, card in inline.items():
+            manifest._append_card(int(index), card)
+        if inline:
+            manifest.save()
+        return manifest
+
+    @property
+    def concept(self):
+        return self.data['concept']
+
+    @property
+    def has_rules(self):
+        return self.data['card_types'] is not None
+
+    @property
+    def rules_text(self):
+        return self.data['rules_text']
+
+    @property
+    def card_types(self):
+        return self.data['card_types']
+
+    def set_rules(self, rules, rules_text, card_types):
+        self.data['rules'] = rules
+        self.data['rules_text'] = rules_text
+        self.data['card_types'] = card_types
+        self.save()
+
+    def clear_cards(self):
+        """Forget every completed card, e.g. because new rules are about to replace the card types"""
+        self.data['cards'] = {}
+        open(self.cards_path, 'w').close()
+
+    def add_card(self, index, card):
+        """Record a finished card, saving its background into the run directory.
+
+        Returns the card with `background` pointing at the saved copy; in-memory
+        backgrounds (io.BytesIO) are kept as they are.
+        """
+        relative = os.path.join('backgrounds', f"{index:04d}.png")
+        destination = self.background_path(index)
+        background = card['background']
+        if isinstance(background, io.BytesIO):
+            _atomic_write(background.getvalue(), destination)
+        else:
+            _atomic_copy(background, destination)
+            background = destination
+        self._append_card(index, dict(card, background=relative))
+        return dict(card, background=background)
+
+    def background_path(self, index):
+        """Where the background of the card at deck position `index` is saved"""
+        return os.path.join(self.run_dir, 'backgrounds', f"{index:04d}.png")
+
+    def completed_cards(self):
+        """Return {deck index: card} for every card already in the manifest"""
+        cards = {}
+        for index, card in self.data['cards'].items():
+            background = os.path.join(self.run_dir, card['background'])
+            if os.path.exists(background):
+                cards[int(index)] = dict(card, background=background)
+        return cards
+
+    def save(self):
+        """Rewrite manifest.json; the cards are in the card log"""
+        fd, temp_path = tempfile.mkstemp(dir=self.run_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({key: value for key, value in self.data.items() if key != 'cards'}, f, indent=2)
+        replace_file(temp_path, self.path)
+
+    def _append_card(self, index, card):
+        self.data['cards'][str(index)] = card
+        with open(self.cards_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"index": index, "card": card}) + '\n')
+
+    def _read_card_log(self):
+        """Return {str(deck index): card} from the card log, dropping a line cut short by a crash"""
+        cards = {}
+        try:
+            f = open(self.cards_path, 'rb+')
+        except FileNotFoundError:
+            return cards
+        with f:
+            end = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("unterminated entry")
+                    entry = json.loads(line)
+                except ValueError:
+                    # Cut the log back to its last complete entry, so new ones start on a line of their own
+                    f.truncate(end)
+                    break
+                cards[str(entry['index'])] = entry['card']
+                end += len(line)
+        return cards
+
+
+def _atomic_write(data, destination):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    replace_file(temp_path, destination)
+
+
+def _atomic_copy(source, destination):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+    os.close(fd)
+    shutil.copyfile(source, temp_path)
+    replace_file(temp_path, destination)
@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from fileutil import replace_file
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "total_s": round(sum(values), 4),
+        "p50_s": round(percentile(values, 0.50), 4),
+        "p90_s": round(percentile(values, 0.90), 4),
+        "p99_s": round(percentile(values, 0.99), 4),
+        "max_s": round(max(values), 4)
+    }
+
+
+class RunMetrics:
+    """Stage timings and counters collected while generating decks.
+
+    Stages are timed with `with metrics.stage('card_text'):`; counters (tokens, retries,
+    fallbacks, cache hits...) with `metrics.increment(name, amount)`. Every event is also
+    passed to the registered hooks as `hook(event, name, **data)`, where event is
+    'stage_start', 'stage_end' (with `duration` and `error`) or 'count' (with `amount`),
+    so callers can forward them to their own tracing.
+
+    Increments made with an `endpoint` attribute (retries, rate limiting) are also
+    counted per endpoint, in `endpoint_counters[name][endpoint]`.
+    """
+
+    def __init__(self, hooks=()):
+        self.stages = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.endpoint_counters = defaultdict(lambda: defaultdict(int))
+        self.hooks = list(hooks)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name, **attrs):
+        self._emit('stage_start', name, **attrs)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.stages[name].append(duration)
+            self._emit('stage_end', name, duration=duration, error=error, **attrs)
+
+    def increment(self, name, amount=1, **attrs):
+        self.counters[name] += amount
+        if 'endpoint' in attrs:
+            self.endpoint_counters[name][attrs['endpoint']] += amount
+        self._emit('count', name, amount=amount, **attrs)
+
+    def report(self):
+        return {
+            "stages": {name: summarize(durations) for name, durations in self.stages.items() if durations},
+            "counters": dict(self.counters),
+            "endpoint_counters": {name: dict(counts) for name, counts in self.endpoint_counters.items()}
+        }
+
+    def write_json(self, path):
+        _atomic_write(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path, prefix='cardgen'):
+        """Write the metrics in the Prometheus text format (e.g. for node_exporter's textfile collector)"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each generation stage",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for name, durations in sorted(self.stages.items()):
+            if not durations:
+                continue
+            for quantile in (0.5, 0.9, 0.99):
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} '
+                             f'{percentile(durations, quantile):.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {sum(durations):.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {len(durations)}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            if name in self.endpoint_counters:
+                for endpoint, count in sorted(self.endpoint_counters[name].items()):
+                    lines.append(f'{prefix}_{name}_total{{endpoint="{endpoint}"}} {count}')
+            else:
+                lines.append(f"{prefix}_{name}_total {value}")
+        _atomic_write(path, '\n'.join(lines) + '\n')
+
+    def _emit(self, event, name, **data):
+        for hook in self.hooks:
+            hook(event, name, **data)
+
+
+def _atomic_write(path, text):
+    # Scrapers may read the file at any time, so never expose a half-written report
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    replace_file(temp_path, path)
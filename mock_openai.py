@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import time
+
+from aiohttp import web
+from PIL import Image, ImageFilter
+
+
+class MockOpenAIServer:
+    """Local stand-in for the OpenAI chat completions and image generation endpoints.
+
+    Chat requests get canned function-call arguments for `define_game_rules`,
+    `generate_card` and `generate_cards`; image requests get a URL served by the same
+    server. Every API request waits `latency` seconds (+/- `jitter`), fails with a 500
+    with probability `error_rate` and with a 429 (with Retry-After) with probability
+    `rate_limit_rate`. The rules response describes a deck of `deck_size` cards.
+
+    Streamed chat requests (`stream: true`) are answered with server-sent events that
+    spread the function arguments over the same `latency`, like a model generating tokens.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, jitter=0.02, image_latency=None,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after_ms=200, deck_size=10, image_variants=8,
+                 seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.image_latency = latency if image_latency is None else image_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.deck_size = deck_size
+        self.first_token_fraction = 0.1  # Share of `latency` a stream waits before its first chunk
+        self.random = random.Random(seed)
+        self.images = [self._make_image(i) for i in range(image_variants)]
+        self.stats = {'chat': 0, 'images': 0, 'downloads': 0, 'errors': 0, 'rate_limited': 0}
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self._chat)
+        app.router.add_post('/v1/images/generations', self._images)
+        app.router.add_get('/files/{index}.png', self._download)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _chat(self, request):
+        self.stats['chat'] += 1
+        body = await request.json()
+        stream = body.get('stream', False)
+        # A stream sends its headers after the first token and the rest over the latency
+        failure = await self._simulate(self.latency * (self.first_token_fraction if stream else 1))
+        if failure is not None:
+            return failure
+
+        name = body['function_call']['name']
+        if name == 'define_game_rules':
+            arguments = self._rules()
+        elif name == 'generate_card':
+            arguments = self._card()
+        else:
+            match = re.search(r'Generate (\d+) card', body['messages'][-1]['content'])
+            arguments = {"cards": [self._card() for _ in range(int(match.group(1)) if match else 1)]}
+
+        arguments = json.dumps(arguments)
+        prompt_tokens = len(json.dumps(body['messages'])) // 4
+        completion_tokens = len(arguments) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if stream:
+            include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+            return await self._stream_chat(request, body, name, arguments, usage if include_usage else None)
+        return web.json_response({
+            "id": f"chatcmpl-mock-{self.stats['chat']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-4o'),
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "function_call": {"name": name, "arguments": arguments}
+                },
+                "finish_reason": "function_call"
+            }],
+            "usage": usage
+        }, headers=self._rate_limit_headers())
+
+    async def _stream_chat(self, request, body, name, arguments, usage, chunk_chars=64):
+        response = web.StreamResponse(headers=dict(self._rate_limit_headers(), **{
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache'
+        }))
+        await response.prepare(request)
+        chunk = {
+            "id": f"chatcmpl-mock-{self.stats['chat']}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-4o')
+        }
+
+        async def send(choices, **extra):
+            event = dict(chunk, choices=choices, **extra)
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+
+        pieces = [arguments[i:i + chunk_chars] for i in range(0, len(arguments), chunk_chars)]
+        delay = self.latency * (1 - self.first_token_fraction) / max(1, len(pieces))
+        await send([{"index": 0, "delta": {"role": "assistant", "content": None,
+                                           "function_call": {"name": name, "arguments": ""}},
+                     "finish_reason": None}])
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            await send([{"index": 0, "delta": {"function_call": {"arguments": piece}}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "function_call"}])
+        if usage is not None:
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _images(self, request):
+        self.stats['images'] += 1
+        failure = await self._simulate(self.image_latency)
+        if failure is not None:
+            return failure
+
+        index = self.random.randrange(len(self.images))
+        return web.json_response({
+            "created": int(time.time()),
+            "data": [{"url": f"http://{self.host}:{self.port}/files/{index}.png"}]
+        }, headers=self._rate_limit_headers())
+
+    async def _download(self, request):
+        self.stats['downloads'] += 1
+        index = int(request.match_info['index'])
+        return web.Response(body=self.images[index], content_type='image/png')
+
+    async def _simulate(self, latency):
+        """Sleep for the configured latency and maybe return an injected error response"""
+        await asyncio.sleep(max(0.0, latency + self.random.uniform(-self.jitter, self.jitter)))
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.stats['rate_limited'] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={'retry-after-ms': str(self.retry_after_ms)}
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response(
+                {"error": {"message": "Internal server error (mock)", "type": "server_error"}},
+                status=500
+            )
+        return None
+
+    def _rate_limit_headers(self):
+        return {
+            'x-ratelimit-remaining-requests': '10000',
+            'x-ratelimit-reset-requests': '6ms',
+            'x-ratelimit-remaining-tokens': '1000000',
+            'x-ratelimit-reset-tokens': '0s'
+        }
+
+    def _rules(self):
+        # Split the deck into three card types
+        quantities = [self.deck_size // 3] * 3
+        quantities[0] += self.deck_size - sum(quantities)
+        card_types = [
+            {"type": name, "quantity": quantity, "description": f"Mock {name.lower()} card"}
+            for name, quantity in zip(("Action", "Item", "Event"), quantities)
+            if quantity > 0
+        ]
+        return {
+            "game_title": "Mock Game",
+            "objective": "Benchmark the card generator.",
+            "cards": {"card_types": card_types, "total_cards": self.deck_size},
+            "setup": "Shuffle the deck and deal five cards to each player.",
+            "gameplay": "Players take turns playing one card. " * 20,
+            "winning_conditions": "The first player to run out of cards wins."
+        }
+
+    def _card(self):
+        number = self.random.randrange(1_000_000)
+        return {
+            "title": f"Card {number}",
+            "type": "Action",
+            "description": "Draw two cards, then discard one card of your choice. " * 2,
+            "image_prompt": f"A colorful illustration of card {number}"
+        }
+
+    def _make_image(self, index):
+        """A 1024x1024 PNG with enough texture to compress like a real illustration"""
+        noise = Image.effect_noise((256, 256), 40 + index).resize((1024, 1024)).filter(ImageFilter.GaussianBlur(1))
+        ramp = Image.linear_gradient('L').resize((1024, 1024))
+        img = Image.merge('RGB', (ramp, noise, ramp.rotate(90 * (index % 4))))
+        output = io.BytesIO()
+        img.save(output, format='PNG')
+        return output.getvalue()
+
+
+async def serve(args):
+    server = MockOpenAIServer(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        image_latency=args.image_latency, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, deck_size=args.deck_size
+    )
+    base_url = await server.start()
+    print(f"Mock OpenAI API listening on {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat and image endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per chat request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random +/- seconds added to each latency")
+    parser.add_argument("--image-latency", type=float, help="Seconds per image request (default: --latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with a 429")
+    parser.add_argument("--deck-size", type=int, default=10, help="Total cards in the generated rules")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
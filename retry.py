@@ -0,0 +1,239 @@
+import asyncio
+import email.utils
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by `max_attempts` and `max_delay`"""
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait after failed attempt number `attempt` (0-based)"""
+        if retry_after is not None:
+            # The server told us how long to wait; add a little jitter so that
+            # concurrent callers don't all come back at the same instant
+            return min(self.max_delay, retry_after) * random.uniform(1.0, 1.2)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """Allows `rate` units per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a trial call through after `reset_after` seconds"""
+
+    def __init__(self, failure_threshold=5, reset_after=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self):
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return False  # Half-open: allow a trial call
+        return True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class EndpointLimiter:
+    """Retry, rate-limit and circuit-breaker policy for one API endpoint.
+
+    `requests_per_minute` and `tokens_per_minute` feed token buckets; `max_concurrency`
+    caps requests in flight. Rate-limit response headers (x-ratelimit-remaining-*,
+    x-ratelimit-reset-*) and Retry-After pause the whole endpoint until the quota resets.
+    """
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None,
+                 retry=None, breaker=None):
+        self.name = name
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self._resume_at = 0.0
+        self.metrics = None  # Optional metrics.RunMetrics recording retries
+
+    async def call(self, make_request, tokens=0):
+        """Await `make_request()` under this endpoint's limits, retrying transient failures"""
+        for attempt in range(self.retry.max_attempts):
+            if self.breaker is not None and self.breaker.is_open:
+                raise CircuitOpenError(f"{self.name} circuit is open after repeated failures")
+            await self._wait_for_quota(tokens)
+            try:
+                if self._semaphore is not None:
+                    async with self._semaphore:
+                        result = await make_request()
+                else:
+                    result = await make_request()
+            except Exception as e:
+                status = _status_code(e)
+                if not _is_retryable(e, status) or attempt == self.retry.max_attempts - 1:
+                    if self.breaker is not None:
+                        self.breaker.record_failure()
+                    raise
+                retry_after = _retry_after(_headers(e))
+                delay = self.retry.delay(attempt, retry_after)
+                if status == 429:
+                    self.pause(delay)  # Everyone waits, not just this caller
+                logger.info("%s request failed (%s), retrying in %.1fs", self.name, e, delay)
+                if self.metrics is not None:
+                    self.metrics.increment('retries', endpoint=self.name)
+                    if status == 429:
+                        self.metrics.increment('rate_limited', endpoint=self.name)
+                await asyncio.sleep(delay)
+                continue
+
+            self.observe_headers(getattr(result, 'headers', None))
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    def pause(self, seconds):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def observe_headers(self, headers):
+        """Pause the endpoint when the server reports an exhausted request or token quota"""
+        if not headers:
+            return
+        for kind in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = _parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is not None and reset is not None and remaining.strip() == '0':
+                self.pause(reset)
+
+    async def _wait_for_quota(self, tokens):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+
+class RateLimiter:
+    """The EndpointLimiters used by a CardGenerator, keyed by endpoint name.
+
+    'chat' and 'images' cover the OpenAI endpoints and 'download' the image downloads;
+    the images endpoint has a circuit breaker so callers can switch to a fallback
+    image once generation keeps failing.
+    """
+
+    def __init__(self, **endpoints):
+        self.endpoints = {
+            'chat': EndpointLimiter('chat'),
+            'images': EndpointLimiter('images', breaker=CircuitBreaker()),
+            'download': EndpointLimiter('download', retry=RetryPolicy(max_attempts=3)),
+        }
+        self.endpoints.update(endpoints)
+
+    def __getitem__(self, name):
+        return self.endpoints[name]
+
+    def attach_metrics(self, metrics):
+        """Record retries on every endpoint that doesn't have metrics yet"""
+        for limiter in self.endpoints.values():
+            if limiter.metrics is None:
+                limiter.metrics = metrics
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(error, 'status', None)  # aiohttp.ClientResponseError
+    return status if isinstance(status, int) else None
+
+
+def _is_retryable(error, status):
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # Imported here to keep `import retry` cheap; both are loaded by the time requests fail
+    import aiohttp
+    import openai
+    return isinstance(error, (openai.APIConnectionError, aiohttp.ClientError, asyncio.TimeoutError,
+                              ConnectionError))
+
+
+def _headers(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+    return headers or {}
+
+
+def _retry_after(headers):
+    """Seconds to wait according to Retry-After / retry-after-ms, or None"""
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return _parse_duration(headers.get('x-ratelimit-reset-requests'))
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+def _parse_duration(value):
+    """Parse OpenAI reset durations such as '1s', '6m0s' or '20ms' into seconds"""
+    if not value:
+        return None
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
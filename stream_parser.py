@@ -0,0 +1,56 @@
+import json
+import re
+
+
+class ArrayItemParser:
+    """Pull the items of one JSON array out of a document that is still being streamed.
+
+    Feed the document text as it arrives; `on_item(item)` is called once for every
+    element of the first array stored under `key` as soon as that element is complete,
+    long before the rest of the document has been received. Items must be objects,
+    arrays or strings: a number at the end of the buffer may still be missing digits.
+    """
+
+    def __init__(self, key, on_item):
+        self.on_item = on_item
+        self.emitted = 0
+        self._start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = None  # Index just past the last parsed item, once the array is found
+        self._done = False
+
+    def feed(self, text):
+        if self._done:
+            return
+        self._buffer += text
+        if self._position is None:
+            match = self._start.search(self._buffer)
+            if match is None:
+                return
+            self._position = match.end()
+
+        while True:
+            # Skip the separator before the next item
+            position = self._position
+            while position < len(self._buffer) and self._buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(self._buffer):
+                return
+            if self._buffer[position] == ']':
+                self._done = True
+                return
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                return  # The item is still incomplete
+            self._position = end
+            self.emitted += 1
+            self.on_item(item)
+
+    def finish(self, items):
+        """Emit whatever part of the complete array `items` the stream didn't deliver"""
+        self._done = True
+        for item in items[self.emitted:]:
+            self.emitted += 1
+            self.on_item(item)